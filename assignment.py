@@ -0,0 +1,141 @@
+import argparse
+import copy
+import xml.etree.ElementTree as ET
+import startstop as Stp
+from xml_stream import XmlStreamWriter, iter_children
+
+"""
+ Precomputed start-stop assignment. The seeded hash assignment of StartStopController is applied to the vehicles of a
+ route file before the simulation: every start-stop vehicle gets the start-stop copy of its vehicle type (eg.
+ intelligent_driver.start-stop), which is a copy of the original type definition with its parameters and child
+ elements. The vehicles of flows are only named by SUMO at runtime, so every flow gets a vTypeDistribution of its type
+ and the start-stop copy instead, with the ratio as the probability of the copy; SUMO draws the type of every vehicle
+ of the flow with its own random number generator (--seed).
+ The simulation and the replay of the new route file have to recognize the start-stop vehicles by their type only
+ (ratio_based_simulation=False). The type is reported by SUMO at the departure anyway, so the assignment costs nothing
+ at runtime. With ratio_based_simulation, the ratio assignment would add further start-stop vehicles to the
+ precomputed ones.
+ Usage: python assignment.py examples/route_free.rou.xml examples/route_free_start_stop.rou.xml --ratio 80 --seed 42
+        --types examples/input_additional.add.xml
+"""
+
+DEFAULT_VEHICLE_TYPE = 'DEFAULT_VEHTYPE'
+# Suffix of the vTypeDistribution of a vehicle type and its start-stop copy, used by the flows
+MIXED_TYPE_SUFFIX = '.start-stop-mix'
+
+
+def read_vehicle_types(files):
+    """
+     A function to collect the vehicle type definitions of SUMO route or additional files.
+     :return: Dictionary of the vType elements keyed by type id.
+    """
+    vehicle_types = {}
+    for file in files:
+        for event, element in ET.iterparse(file, events=('end',)):
+            if element.tag == 'vType':
+                vehicle_types[element.attrib['id']] = element
+    return vehicle_types
+
+
+def start_stop_type(vehicle_type):
+    """
+     Returns the vType element of the start-stop copy of a vType element. The copy keeps the child elements of the
+     type (eg. param, carFollowing), only its id is changed.
+    """
+    element = copy.deepcopy(vehicle_type)
+    element.set('id', vehicle_type.attrib['id'] + Stp.START_STOP_TYPE_SUFFIX)
+    element.tail = '\n    '
+    return element
+
+
+def mixed_type(vehicle_type, start_stop_ratio):
+    """
+     Returns the vTypeDistribution of a vehicle type and its start-stop copy, which draws the copy with the
+     start_stop_ratio given in %.
+    """
+    share = start_stop_ratio / 100.0
+    element = ET.Element('vTypeDistribution', {
+        'id': vehicle_type + MIXED_TYPE_SUFFIX,
+        'vTypes': f'{vehicle_type} {vehicle_type}{Stp.START_STOP_TYPE_SUFFIX}',
+        'probabilities': f'{1 - share:g} {share:g}'})
+    element.tail = '\n    '
+    return element
+
+
+def precompute_assignment(route_file, output_file, start_stop_ratio, seed, type_files=()):
+    """
+     A function to write a copy of a route file in which the start-stop vehicles have the start-stop copy of their
+     vehicle type. The copies of the types defined in type_files are written at the beginning of the route file, the
+     copies of the types defined in the route file right after them. The flows get the vTypeDistribution of their
+     type and its start-stop copy (see mixed_type), written right before the first flow of the type. The route file is
+     streamed one top-level element at a time.
+     :param route_file: The SUMO route file.
+     :param output_file: The path of the route file with the precomputed assignment.
+     :param start_stop_ratio: Ratio of the start-stop vehicles given in %.
+     :param seed: The seed of the assignment, the simulation and the replay use the same seed as assignment_seed.
+     :param type_files: Further files defining the vehicle types of the route file (eg. additional files).
+     :return: Dictionary with the number of vehicles, start-stop vehicles, vehicles and flows of unknown types and
+      flows.
+    """
+    vehicle_types = read_vehicle_types(type_files)
+    vehicle_types.setdefault(DEFAULT_VEHICLE_TYPE, ET.Element('vType', id=DEFAULT_VEHICLE_TYPE))
+    mixed_types = set()
+    threshold = start_stop_ratio / 100.0
+    counts = {'vehicles': 0, 'start_stop_vehicles': 0, 'unknown_types': 0, 'flows': 0}
+
+    # The types of the other files are loaded before the route file
+    type_copies = [start_stop_type(vehicle_type) for vehicle_type in vehicle_types.values()]
+    with XmlStreamWriter(output_file, head=type_copies) as writer:
+        for item in iter_children(route_file, writer):
+            if item.tag == 'vType':
+                writer.write(item)
+                if item.attrib['id'] not in vehicle_types:
+                    vehicle_types[item.attrib['id']] = item
+                    writer.write(start_stop_type(item))
+                continue
+            if item.tag in ('vehicle', 'trip'):
+                counts['vehicles'] += 1
+                vehicle_type = item.attrib.get('type', DEFAULT_VEHICLE_TYPE)
+                if Stp.assignment_share(item.attrib['id'], seed) < threshold and \
+                        not Stp.is_start_stop_type(vehicle_type):
+                    if vehicle_type in vehicle_types:
+                        item.set('type', vehicle_type + Stp.START_STOP_TYPE_SUFFIX)
+                        counts['start_stop_vehicles'] += 1
+                    else:
+                        counts['unknown_types'] += 1
+            elif item.tag == 'flow':
+                counts['flows'] += 1
+                vehicle_type = item.attrib.get('type', DEFAULT_VEHICLE_TYPE)
+                if not Stp.is_start_stop_type(vehicle_type):
+                    if vehicle_type in vehicle_types:
+                        if vehicle_type not in mixed_types:
+                            mixed_types.add(vehicle_type)
+                            writer.write(mixed_type(vehicle_type, start_stop_ratio))
+                        item.set('type', vehicle_type + MIXED_TYPE_SUFFIX)
+                    else:
+                        counts['unknown_types'] += 1
+            writer.write(item)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precomputes the seeded start-stop assignment of a route file.")
+    parser.add_argument("route_file", help="SUMO route file.")
+    parser.add_argument("output_file", help="Route file with the precomputed assignment.")
+    parser.add_argument("--ratio", type=float, required=True, help="Start-stop ratio in %%.")
+    parser.add_argument("--seed", type=int, required=True, help="Seed of the assignment.")
+    parser.add_argument("--types", nargs="*", default=[], help="Files defining the vehicle types (eg. additionals).")
+    args = parser.parse_args()
+
+    counts = precompute_assignment(args.route_file, args.output_file, args.ratio, args.seed, args.types)
+    print(f"{counts['start_stop_vehicles']} of {counts['vehicles']} vehicles assigned to the start-stop group.")
+    if counts['unknown_types']:
+        print(f"{counts['unknown_types']} vehicles and flows have types that are not defined in the given files, "
+              f"they are no start-stop vehicles.")
+    if counts['flows']:
+        print(f"{counts['flows']} flows draw the start-stop type of their vehicles in the simulation.")
+    print("Run the simulation of the new route file with ratio_based_simulation=False.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+import argparse
+import contextlib
+import csv
+import io
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import traci.constants as tc
+import startstop as Stp
+
+"""
+ Benchmarks of the start-stop simulation without a SUMO installation.
+ A mocked TraCI backend replays a synthetic traffic scenario and charges a fixed latency for every TraCI round-trip,
+ the way a socket connection to a real SUMO instance does.
+ The collection benchmark compares the polling and the subscription-based collection of the vehicle values.
+ The memory benchmark compares the stop episodes of the start-stop emission data with the per-step records they stand
+ for on a synthetic scenario.
+ The suite runs the whole processing chain on a synthetic scenario and its synthetic SUMO emission dump, and times
+ every stage (the simulation loop, create_start_stop_emissions and calculate_cumulative_emissions) and measures its
+ peak memory. The results are appended to a CSV file together with the code version and compared with the previous
+ run of the same scenario, so regressions in throughput and memory show up between versions.
+ Usage: python benchmark.py collection --vehicles 5000 --steps 20 --latency 0.00002
+        python benchmark.py memory --vehicles 1000 --steps 3600 --stop-period 120 --stop-length 60
+        python benchmark.py suite --vehicles 2000 --steps 1800 --stop-period 40 --stop-length 12
+"""
+
+# Size of a per-step record in columns: the vehicle and the step index and the five emission values
+RECORD_BYTES = 4 + 4 + 5 * 8
+# Emission class of the synthetic vehicles
+EMISSION_CLASS = 'HBEFA4/PC_petrol_Euro-4'
+# Emission rates (CO2, CO, HC, NOx, PMx) of the synthetic vehicles while standing and while driving
+IDLE_EMISSIONS = (1400.0, 1.1e-10, 4.5e-13, 0.61, 7.2e-05)
+DRIVING_EMISSIONS = (3500.0, 2.2e-10, 9.1e-13, 1.52, 1.4e-04)
+
+RESULTS_FILE = "benchmark_results.csv"
+SCENARIO_FIELDS = ['vehicles', 'steps', 'stop_period', 'stop_length', 'departure_steps', 'trip_steps']
+RESULT_FIELDS = ['timestamp', 'version'] + SCENARIO_FIELDS + ['stage', 'seconds', 'vehicle_steps_per_second',
+                                                              'peak_bytes']
+
+
+class SyntheticScenario:
+    """
+     Synthetic traffic scenario of a given scale. The vehicles depart evenly spread over the first departure_steps
+     steps, stay in the network for trip_steps steps (0 keeps them until the end) and periodically stop for
+     stop_length of every stop_period steps, so the start-stop state machine is exercised. The vehicles alternate
+     between the start-stop-vehicle and the intelligent_driver type. With a creep_speed, the start-stop vehicles creep
+     at that speed in the second step of every stop instead of standing.
+     :param vehicle_count: The number of vehicles.
+     :param steps: The number of simulation steps.
+     :param stop_period: The number of steps between two stops of a vehicle.
+     :param stop_length: The number of steps a stop lasts.
+     :param departure_steps: The number of steps the departures are spread over.
+     :param trip_steps: The number of steps a vehicle stays in the network, 0 keeps it until the end.
+     :param creep_speed: The speed of a creeping vehicle, below the precision of the emission output it is written as
+      a stop.
+    """
+
+    def __init__(self, vehicle_count, steps, stop_period=40, stop_length=12, departure_steps=1, trip_steps=0,
+                 creep_speed=0.0):
+        self.vehicle_count = vehicle_count
+        self.steps = steps
+        self.stop_period = stop_period
+        self.stop_length = stop_length
+        self.departure_steps = departure_steps
+        self.trip_steps = trip_steps
+        self.creep_speed = creep_speed
+        self.vehicle_ids = [f"veh{index}" for index in range(vehicle_count)]
+        self.departures = {}
+        self.arrivals = {}
+        self.vehicle_steps = 0
+        for index, vehicle_id in enumerate(self.vehicle_ids):
+            depart_step = index * max(departure_steps, 1) // max(vehicle_count, 1)
+            arrival_step = depart_step + trip_steps if trip_steps > 0 else steps
+            self.departures.setdefault(depart_step, []).append(vehicle_id)
+            if arrival_step < steps:
+                self.arrivals.setdefault(arrival_step, []).append(vehicle_id)
+            self.vehicle_steps += max(min(arrival_step, steps) - depart_step, 0)
+
+    def parameters(self):
+        """Returns the parameters of the scenario as a dictionary."""
+        return {'vehicles': self.vehicle_count, 'steps': self.steps, 'stop_period': self.stop_period,
+                'stop_length': self.stop_length, 'departure_steps': self.departure_steps,
+                'trip_steps': self.trip_steps}
+
+    def speed(self, vehicle_index, step):
+        stop_step = (step + vehicle_index) % self.stop_period
+        if stop_step < self.stop_length:
+            return self.creep_speed if stop_step == 1 and vehicle_index % 2 else 0.0
+        return 13.9
+
+    def values(self, vehicle_id, step):
+        vehicle_index = int(vehicle_id[3:])
+        speed = self.speed(vehicle_index, step)
+        emissions = IDLE_EMISSIONS if speed < Stp.STOP_SPEED else DRIVING_EMISSIONS
+        return {tc.VAR_SPEED: speed,
+                tc.VAR_CO2EMISSION: emissions[0],
+                tc.VAR_COEMISSION: emissions[1],
+                tc.VAR_HCEMISSION: emissions[2],
+                tc.VAR_NOXEMISSION: emissions[3],
+                tc.VAR_PMXEMISSION: emissions[4],
+                tc.VAR_ROAD_ID: f"edge{vehicle_index % 10}",
+                tc.VAR_TYPE: 'start-stop-vehicle' if vehicle_index % 2 else 'intelligent_driver'}
+
+    def write_emission_dump(self, emissions_file, steptime=1.0):
+        """
+         Writes the SUMO emission output of the scenario, as SUMO would write it for the vehicles served by MockTraci.
+         The dump holds one vehicle element per vehicle step, so its size grows with the vehicles and the steps.
+         :return: The size of the dump in bytes.
+        """
+        active = {}
+        with open(emissions_file, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<emission-export>\n')
+            for step in range(self.steps):
+                for vehicle_id in self.arrivals.get(step, ()):
+                    del active[vehicle_id]
+                for vehicle_id in self.departures.get(step, ()):
+                    active[vehicle_id] = int(vehicle_id[3:])
+                f.write(f'    <timestep time="{step * steptime:.2f}">\n')
+                for vehicle_id, vehicle_index in active.items():
+                    speed = self.speed(vehicle_index, step)
+                    stopped = speed < Stp.STOP_SPEED
+                    co2, co, hc, nox, pmx = IDLE_EMISSIONS if stopped else DRIVING_EMISSIONS
+                    vehicle_type = 'start-stop-vehicle' if vehicle_index % 2 else 'intelligent_driver'
+                    f.write(f'        <vehicle id="{vehicle_id}" eclass="{EMISSION_CLASS}" '
+                            f'CO2="{co2 * steptime}" CO="{co * steptime}" HC="{hc * steptime}" '
+                            f'NOx="{nox * steptime}" PMx="{pmx * steptime}" fuel="{co2 * steptime / 3.15}" '
+                            f'electricity="0.00" noise="{55.0 if stopped else 68.0}" '
+                            f'route="route{vehicle_index % 10}" type="{vehicle_type}" waiting="0.00" '
+                            f'lane="edge{vehicle_index % 10}_0" '
+                            f'pos="{(step * speed) % 500:.2f}" speed="{speed:.2f}" angle="90.00" x="0.00" y="0.00"/>\n')
+                f.write('    </timestep>\n')
+            f.write('</emission-export>\n')
+        return os.path.getsize(emissions_file)
+
+
+class MockTraci:
+    """
+     Stand-in for the traci module serving a SyntheticScenario. The vehicles depart and arrive as given by the
+     scenario, and every TraCI round-trip is charged a fixed latency, the way a socket connection to a real SUMO
+     instance does. The time the mock spends computing the subscription results is summed up in server_time, so it
+     can be kept apart from the time of the start-stop processing.
+    """
+
+    def __init__(self, scenario, latency=0.0):
+        self.scenario = scenario
+        self.latency = latency
+        self.step = -1
+        self.round_trips = 0
+        self.server_time = 0.0
+        self.closed = False
+        self.active_vehicles = {}
+        self.departed = []
+        self.arrived = []
+        self.vehicle = MockVehicleDomain(self)
+        self.simulation = MockSimulationDomain(self)
+        self.vehicletype = MockVehicleTypeDomain(self)
+
+    def round_trip(self):
+        """Simulates the socket latency of a single TraCI command."""
+        self.round_trips += 1
+        if self.latency <= 0:
+            return
+        end = time.perf_counter() + self.latency
+        while time.perf_counter() < end:
+            pass
+
+    def simulationStep(self):
+        self.round_trip()
+        start = time.perf_counter()
+        self.step += 1
+        self.arrived = self.scenario.arrivals.get(self.step, [])
+        for vehicle_id in self.arrived:
+            del self.active_vehicles[vehicle_id]
+        self.departed = self.scenario.departures.get(self.step, [])
+        for vehicle_id in self.departed:
+            self.active_vehicles[vehicle_id] = True
+        self.vehicle.refresh_subscriptions()
+        self.server_time += time.perf_counter() - start
+
+    def values(self, vehicle_id):
+        return self.scenario.values(vehicle_id, self.step)
+
+    def load_state(self, state_file):
+        """Continues the scenario after the step saved in the state file (see MockSimulationDomain.saveState)."""
+        with open(state_file) as file:
+            self.step = int(file.read())
+        self.active_vehicles = {}
+        for step in range(self.step + 1):
+            for vehicle_id in self.scenario.arrivals.get(step, []):
+                del self.active_vehicles[vehicle_id]
+            for vehicle_id in self.scenario.departures.get(step, []):
+                self.active_vehicles[vehicle_id] = True
+
+    def close(self):
+        self.closed = True
+
+
+class MockSimulationDomain:
+
+    def __init__(self, server):
+        self.server = server
+
+    def getDepartedIDList(self):
+        self.server.round_trip()
+        return list(self.server.departed)
+
+    def getArrivedIDList(self):
+        self.server.round_trip()
+        return list(self.server.arrived)
+
+    def saveState(self, file_name):
+        self.server.round_trip()
+        with open(file_name, 'w') as file:
+            file.write(str(self.server.step))
+
+
+class MockVehicleTypeDomain:
+
+    def __init__(self, server):
+        self.server = server
+
+    def getEmissionClass(self, vehicle_type):
+        self.server.round_trip()
+        return EMISSION_CLASS
+
+
+class MockVehicleDomain:
+
+    def __init__(self, server):
+        self.server = server
+        self.subscriptions = {}
+        self.subscription_results = {}
+
+    def refresh_subscriptions(self):
+        # SUMO drops the subscriptions of the arrived vehicles
+        for vehicle_id in self.server.arrived:
+            self.subscriptions.pop(vehicle_id, None)
+        self.subscription_results = {vehicle_id: {variable: values[variable] for variable in variables}
+                                     for vehicle_id, variables in self.subscriptions.items()
+                                     for values in [self.server.values(vehicle_id)]}
+
+    def _get(self, vehicle_id, variable):
+        self.server.round_trip()
+        return self.server.values(vehicle_id)[variable]
+
+    def getIDList(self):
+        self.server.round_trip()
+        return list(self.server.active_vehicles)
+
+    def getTypeID(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_TYPE)
+
+    def getSpeed(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_SPEED)
+
+    def getCO2Emission(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_CO2EMISSION)
+
+    def getCOEmission(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_COEMISSION)
+
+    def getHCEmission(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_HCEMISSION)
+
+    def getNOxEmission(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_NOXEMISSION)
+
+    def getPMxEmission(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_PMXEMISSION)
+
+    def getRoadID(self, vehicle_id):
+        return self._get(vehicle_id, tc.VAR_ROAD_ID)
+
+    def setColor(self, vehicle_id, color):
+        self.server.round_trip()
+
+    def subscribe(self, vehicle_id, variables):
+        self.server.round_trip()
+        self.subscriptions[vehicle_id] = list(variables)
+        values = self.server.values(vehicle_id)
+        self.subscription_results[vehicle_id] = {variable: values[variable] for variable in variables}
+
+    def getAllSubscriptionResults(self):
+        # The results come with the response of simulationStep, reading them is no round-trip
+        return self.subscription_results
+
+
+def benchmark_collection(vehicle_count, steps, latency, use_subscriptions):
+    """
+     A function to time the simulation loop on the mocked backend with the given collection mode.
+     :return: The reached steps per second and the number of TraCI round-trips.
+    """
+    server = MockTraci(SyntheticScenario(vehicle_count, steps), latency)
+    start = time.perf_counter()
+    Stp.simulate_start_stop(server, steps, 1, 50, True, 7, dict(Stp.DEFAULT_IDLE_VALUES), use_subscriptions)
+    elapsed = time.perf_counter() - start
+    return steps / elapsed, server.round_trips
+
+
+def measure(function, trace_memory=True):
+    """
+     A function to time a stage and to measure its peak memory. The time is taken from a run without tracing, since
+     tracemalloc slows down the allocations; the peak memory from a second, traced run.
+     :return: The result of the timed run, its time in seconds and the peak memory in bytes (None without tracing).
+    """
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak_bytes = None
+    if trace_memory:
+        tracemalloc.start()
+        function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def benchmark_suite(scenario, output_dir, latency=0.0, trace_memory=True, steptime=1.0):
+    """
+     A function to run the processing chain of a start-stop simulation on a synthetic scenario and to measure every
+     stage separately. The step loop runs on the mocked backend, the time the mock spends serving the subscriptions is
+     not counted. The cumulative emissions are summed up from the dumps, the way they are computed for existing dumps.
+     :param scenario: The SyntheticScenario.
+     :param output_dir: The folder the synthetic and the start-stop emission dump are written to.
+     :param latency: Latency of a TraCI round-trip in seconds.
+     :param trace_memory: If False, the peak memory of the stages is not measured.
+     :return: List of the results per stage (stage, seconds, vehicle_steps_per_second, peak_bytes).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    dump_start = time.perf_counter()
+    dump_size = scenario.write_emission_dump(os.path.join(output_dir, Stp.DEFAULT_EMISSIONS_FILE), steptime)
+    print(f"Synthetic emission dump: {dump_size / 2 ** 20:.1f} MiB, {scenario.vehicle_steps} vehicle steps, "
+          f"written in {time.perf_counter() - dump_start:.2f} s")
+
+    def step_loop():
+        server = MockTraci(scenario, latency)
+        episodes = Stp.simulate_start_stop(server, scenario.steps * steptime, steptime, 50, True, 7,
+                                           dict(Stp.DEFAULT_IDLE_VALUES))
+        return episodes, server.server_time
+
+    (episodes, server_time), seconds, peak_bytes = measure(step_loop, trace_memory)
+    stages = [('step_loop', seconds - server_time, peak_bytes)]
+
+    def start_stop_emissions():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Stp.create_start_stop_emissions(episodes, output_dir=output_dir)
+
+    stages.append(('create_start_stop_emissions',) + measure(start_stop_emissions, trace_memory)[1:])
+
+    def cumulative_emissions():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Stp.calculate_cumulative_emissions(output_dir=output_dir, plot=False)
+
+    stages.append(('calculate_cumulative_emissions',) + measure(cumulative_emissions, trace_memory)[1:])
+    return [{'stage': stage, 'seconds': seconds, 'vehicle_steps_per_second': scenario.vehicle_steps / seconds,
+             'peak_bytes': peak_bytes} for stage, seconds, peak_bytes in stages]
+
+
+def code_version():
+    """
+     Returns the git version of the benchmarked code (eg. 6a7e9ab-dirty), or unknown outside of a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results(csv_file, scenario):
+    """
+     A function to read the results of the last run of the same scenario from the results file.
+     :return: Dictionary of the result rows keyed by stage, empty if the scenario was not run before.
+    """
+    if not os.path.exists(csv_file):
+        return {}
+    parameters = {field: str(value) for field, value in scenario.parameters().items()}
+    runs = {}
+    with open(csv_file, newline='') as f:
+        for row in csv.DictReader(f):
+            if all(row[field] == value for field, value in parameters.items()):
+                runs.setdefault((row['timestamp'], row['version']), {})[row['stage']] = row
+    return runs[max(runs)] if runs else {}
+
+
+def store_results(csv_file, scenario, results, version):
+    """
+     A function to append the results of a suite run to the results file, one row per stage.
+    """
+    new_file = not os.path.exists(csv_file)
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        for result in results:
+            writer.writerow({'timestamp': timestamp, 'version': version, **scenario.parameters(), **result,
+                             'peak_bytes': '' if result['peak_bytes'] is None else result['peak_bytes']})
+
+
+def compare_results(results, previous, tolerance=0.1):
+    """
+     A function to print the results of a suite run next to the previous run of the same scenario. Stages that lost
+     more than the tolerance of their throughput or gained more than the tolerance of peak memory are marked.
+     :return: The number of regressions.
+    """
+    regressions = 0
+    for result in results:
+        line = (f"{result['stage']:32s} {result['seconds']:9.3f} s {result['vehicle_steps_per_second']:14.0f} "
+                f"vehicle steps/s")
+        if result['peak_bytes'] is not None:
+            line += f" {result['peak_bytes'] / 2 ** 20:9.1f} MiB peak"
+        row = previous.get(result['stage'])
+        if row is not None:
+            throughput_change = result['vehicle_steps_per_second'] / float(row['vehicle_steps_per_second']) - 1
+            line += f" | throughput {throughput_change:+.1%}"
+            regression = throughput_change < -tolerance
+            if result['peak_bytes'] is not None and row['peak_bytes']:
+                memory_change = result['peak_bytes'] / float(row['peak_bytes']) - 1
+                line += f", peak memory {memory_change:+.1%}"
+                regression = regression or memory_change > tolerance
+            if regression:
+                regressions += 1
+                line += " REGRESSION"
+        print(line)
+    if previous:
+        row = next(iter(previous.values()))
+        print(f"Compared with version {row['version']} run at {row['timestamp']}.")
+    return regressions
+
+
+def episode_records(episodes):
+    """
+     Generates the per-step records the stop episodes stand for: a record of every engine-off step and of every
+     restart of a start-stop vehicle, with placeholder emission values.
+    """
+    engine_off_values = [0.0] * len(Stp.EMISSION_TYPES)
+    for vehicle, start, end, engine_off, penalty in episodes.rows().tolist():
+        vehicle_id = episodes.vehicle_ids[vehicle]
+        for step in range(engine_off, end):
+            yield vehicle_id, step, engine_off_values
+        if any(penalty):
+            yield vehicle_id, end, list(penalty)
+
+
+def benchmark_memory(scenario, steptime=1.0):
+    """
+     A function to measure the memory of the start-stop emission data of a synthetic scenario, stored as the stop
+     episodes of the simulation and as the per-step records they stand for. The records are measured as the nested
+     dictionaries formerly used and computed for columns of RECORD_BYTES per record.
+     :return: The number of episodes and records and the memory of the episodes, the nested dictionaries and the
+      columns in bytes.
+    """
+    episodes = Stp.simulate_start_stop(MockTraci(scenario), scenario.steps * steptime, steptime, 50, True, 7,
+                                       dict(Stp.DEFAULT_IDLE_VALUES))
+    tracemalloc.start()
+    nested = {}
+    for vehicle_id, step, values in episode_records(episodes):
+        nested.setdefault(vehicle_id, {})[step * steptime] = dict(zip(Stp.EMISSION_TYPES, values))
+    nested_bytes = tracemalloc.get_traced_memory()[0]
+    del nested
+    tracemalloc.stop()
+    records = episodes.record_count()
+    return len(episodes), records, episodes.nbytes(), nested_bytes, records * RECORD_BYTES
+
+
+def synthetic_scenario(args, default_steps):
+    """
+     Returns the SyntheticScenario of the command line arguments.
+    """
+    steps = args.steps or default_steps
+    return SyntheticScenario(args.vehicles or 1000, steps, args.stop_period, args.stop_length,
+                             steps // 2 if args.departure_steps is None else args.departure_steps,
+                             steps // 3 if args.trip_steps is None else args.trip_steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the start-stop simulation without SUMO.")
+    parser.add_argument("benchmark", choices=["collection", "memory", "suite"], help="The benchmark to run.")
+    parser.add_argument("--vehicles", type=int,
+                        help="Number of vehicles (5000 for collection, 1000 for memory and suite).")
+    parser.add_argument("--steps", type=int,
+                        help="Number of simulation steps (20 for collection, 3600 for memory, 900 for suite).")
+    parser.add_argument("--latency", type=float,
+                        help="Latency of a TraCI round-trip in seconds (20e-6, 0 for suite).")
+    parser.add_argument("--stop-period", type=int, default=40,
+                        help="Steps between two stops of a vehicle (memory and suite).")
+    parser.add_argument("--stop-length", type=int, default=12, help="Steps a stop lasts (memory and suite).")
+    parser.add_argument("--departure-steps", type=int,
+                        help="Steps the departures are spread over (memory and suite, half of the steps by default).")
+    parser.add_argument("--trip-steps", type=int,
+                        help="Steps a vehicle stays in the network, 0 until the end (memory and suite, a third of the "
+                             "steps).")
+    parser.add_argument("--output-dir", default="results/benchmark", help="Folder of the emission dumps (suite).")
+    parser.add_argument("--results", default=RESULTS_FILE, help="CSV file the suite results are appended to.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Throughput loss or memory growth counted as a regression (suite).")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure the peak memory (suite).")
+    args = parser.parse_args()
+
+    if args.benchmark == "collection":
+        vehicles = args.vehicles or 5000
+        steps = args.steps or 20
+        latency = 20e-6 if args.latency is None else args.latency
+        print(f"Collection benchmark: {vehicles} vehicles, {steps} steps, "
+              f"{latency * 1e6:.0f} us per round-trip")
+        polling_rate, polling_calls = benchmark_collection(vehicles, steps, latency, False)
+        print(f"Polling:       {polling_rate:10.2f} steps/s {polling_calls:10d} round-trips")
+        subscription_rate, subscription_calls = benchmark_collection(vehicles, steps, latency, True)
+        print(f"Subscriptions: {subscription_rate:10.2f} steps/s {subscription_calls:10d} round-trips")
+        print(f"Speedup: {subscription_rate / polling_rate:.1f}x")
+    elif args.benchmark == "suite":
+        scenario = synthetic_scenario(args, 900)
+        version = code_version()
+        print(f"Benchmark suite of version {version}: {scenario.parameters()}")
+        results = benchmark_suite(scenario, args.output_dir, args.latency or 0.0, not args.no_memory)
+        regressions = compare_results(results, previous_results(args.results, scenario), args.tolerance)
+        store_results(args.results, scenario, results, version)
+        print(f"Results appended to {args.results}")
+        if regressions:
+            print(f"{regressions} stages regressed by more than {args.tolerance:.0%}.")
+    else:
+        scenario = synthetic_scenario(args, 3600)
+        print(f"Memory benchmark: {scenario.parameters()}")
+        episode_count, records, episode_bytes, nested_bytes, record_bytes = benchmark_memory(scenario)
+        print(f"Stop episodes:                {episode_count:12d} {episode_bytes / 2 ** 20:12.2f} MiB")
+        print(f"Per-step records (columns):   {records:12d} {record_bytes / 2 ** 20:12.2f} MiB")
+        print(f"Per-step records (dicts):     {records:12d} {nested_bytes / 2 ** 20:12.2f} MiB")
+        print(f"Reduction: {record_bytes / episode_bytes:.1f}x over columns, {nested_bytes / episode_bytes:.1f}x over "
+              f"dictionaries")
+
+
+if __name__ == "__main__":
+    main()
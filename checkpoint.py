@@ -0,0 +1,230 @@
+import os
+import time
+import numpy as np
+import startstop as Stp
+from emission_store import EPISODE_TYPE
+
+"""
+ Checkpoint/resume of long start-stop simulations. A crashed run continues from its last checkpoint instead of
+ starting over: SUMO loads the saved simulation state (--load-state), the start-stop state is restored from the
+ checkpoint, and the outputs written after the checkpoint are cut off before the run appends to them again.
+"""
+
+CHECKPOINT_FILE = "checkpoint.npz"
+EPISODES_FILE = "stop_episodes.bin"
+VEHICLE_IDS_FILE = "start_stop_vehicles.txt"
+
+
+class Checkpointer:
+    """
+     Saves the state of a running start-stop simulation every interval steps and restores it to resume the run.
+     A checkpoint consists of
+     - the SUMO state, saved through TraCI right after the step, so it matches the start-stop state exactly,
+     - the controller state as a NumPy archive, one row per tracked vehicle, together with the sums of the live
+       totals (and their cube) if the run has live totals,
+     - the stop episodes since the previous checkpoint, appended to a binary file of EPISODE_TYPE rows (the stops
+       running at the checkpoint are part of the controller state),
+     - the sizes of the appended outputs (episodes, vehicle ids, vehicle summary).
+     The time of every checkpoint is measured. If a checkpoint takes longer than max_overhead of the wall time since
+     the previous one, the interval is doubled, which bounds the share of the checkpoints in the run time.
+     :param directory: The folder of the checkpoint files.
+     :param interval: The number of steps between two checkpoints.
+     :param resume: If True, the run continues from the last checkpoint in the folder (if there is one).
+     :param max_overhead: The upper bound of the checkpoint time as a share of the wall time.
+    """
+
+    def __init__(self, directory, interval, resume=False, max_overhead=0.05):
+        self.directory = directory
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.checkpoint_file = os.path.join(directory, CHECKPOINT_FILE)
+        self.episodes_file = os.path.join(directory, EPISODES_FILE)
+        self.vehicle_ids_file = os.path.join(directory, VEHICLE_IDS_FILE)
+        self.times = []  # Wall time of every checkpoint in seconds
+        self.sizes = []  # Written bytes of every checkpoint
+        self.state_file = None  # The SUMO state of the last checkpoint
+        self.summary_offset = None  # The size of the vehicle summary at the last checkpoint
+        self.segments = []  # The emission dumps of the run and their start times, one per (re)start
+        self._checkpoint = None
+        self._last_step = -1
+        self._last_wall_time = time.perf_counter()
+        self._episodes_written = 0
+        self._vehicles_written = 0
+
+        os.makedirs(directory, exist_ok=True)
+        if resume:
+            if os.path.exists(self.checkpoint_file):
+                with np.load(self.checkpoint_file) as archive:
+                    self._checkpoint = {name: archive[name] for name in archive.files}
+                self.state_file = os.path.join(directory, str(self._checkpoint['state_file']))
+                summary_offset = int(self._checkpoint['summary_offset'])
+                self.summary_offset = summary_offset if summary_offset >= 0 else None
+                self.segments = list(zip(self._checkpoint['segment_files'].tolist(),
+                                         self._checkpoint['segment_starts'].tolist()))
+                print(f"Resuming from the checkpoint at {float(self._checkpoint['resume_time'])} s.")
+            else:
+                print(f"No checkpoint found in {directory}, starting a new run.")
+
+    def emission_output(self, emissions_file):
+        """
+         Returns the path SUMO writes the emission output of this (re)start to. A resumed run writes a new segment
+         into the checkpoint folder, the segments are merged by merge_emission_output.
+        """
+        if self._checkpoint is None:
+            self.segments = [(emissions_file, 0.0)]
+            return emissions_file
+        base_name = os.path.splitext(os.path.basename(emissions_file))[0]
+        segment_file = os.path.join(self.directory, f"{base_name}.part{len(self.segments)}.xml")
+        self.segments.append((segment_file, float(self._checkpoint['resume_time'])))
+        return segment_file
+
+    def restore(self, recorder):
+        """
+         Restores the start-stop state of the last checkpoint into the recorder of the run.
+         :return: The index of the first step to simulate.
+        """
+        if self._checkpoint is None:
+            # A new run, the appended outputs start empty
+            open(self.episodes_file, 'wb').close()
+            open(self.vehicle_ids_file, 'w').close()
+            return 0
+
+        checkpoint = self._checkpoint
+        controller = recorder.controller
+        vehicle_ids = checkpoint['vehicle_ids'].tolist()
+        controller.assigned_vehicles = {vehicle_id for vehicle_id, flag in zip(vehicle_ids, checkpoint['assigned'])
+                                        if flag}
+        controller.start_stop_vehicles = {vehicle_id for vehicle_id, flag in
+                                          zip(vehicle_ids, checkpoint['start_stop']) if flag}
+        controller.stop_steps = {vehicle_id: steps for vehicle_id, steps in
+                                 zip(vehicle_ids, checkpoint['stop_steps'].tolist()) if steps}
+        controller.stop_times = {vehicle_id: stop_time for vehicle_id, stop_time in
+                                 zip(vehicle_ids, checkpoint['stop_times'].tolist()) if stop_time}
+        if controller.idle_rates is not None:
+            controller.vehicle_rates = {vehicle_id: row for vehicle_id, row in
+                                        zip(vehicle_ids, checkpoint['rate_rows'].tolist())
+                                        if vehicle_id in controller.start_stop_vehicles}
+        controller.total_vehicles_processed = int(checkpoint['total_vehicles_processed'])
+        live_totals = recorder.live_totals
+        if live_totals is not None:
+            if 'live_default' in checkpoint:
+                live_totals.restore({name[len('live_'):]: value for name, value in checkpoint.items()
+                                     if name.startswith('live_')})
+            else:
+                print("The checkpoint has no live totals, the live totals only cover the resumed part of the run.")
+
+        # Cut off the episodes written after the checkpoint
+        self._episodes_written = int(checkpoint['episodes'])
+        with open(self.episodes_file, 'r+b') as f:
+            f.truncate(self._episodes_written * EPISODE_TYPE.itemsize)
+        with open(self.vehicle_ids_file, 'r+', encoding='utf-8') as f:
+            f.truncate(int(checkpoint['vehicle_ids_offset']))
+        with open(self.vehicle_ids_file, encoding='utf-8') as f:
+            store_vehicle_ids = f.read().splitlines()
+        self._vehicles_written = len(store_vehicle_ids)
+        recorder.episodes.restore(store_vehicle_ids, np.fromfile(self.episodes_file, dtype=EPISODE_TYPE))
+
+        self._last_step = recorder.last_step = int(checkpoint['step'])
+        self._last_wall_time = time.perf_counter()
+        return self._last_step + 1
+
+    def due(self, step):
+        """
+         Returns True if a checkpoint is due after the given step.
+        """
+        return step - self._last_step >= self.interval
+
+    def save(self, conn, step, recorder):
+        """
+         Saves a checkpoint after the given step.
+         :param conn: The TraCI connection of the run.
+         :param step: The index of the step that was just processed.
+         :param recorder: The StartStopRecorder of the run.
+        """
+        start = time.perf_counter()
+        store = recorder.episodes
+        controller = recorder.controller
+
+        # Append the new episodes and vehicle ids
+        appended = (len(store) - self._episodes_written) * EPISODE_TYPE.itemsize
+        with open(self.episodes_file, 'ab') as f:
+            store.rows(self._episodes_written).tofile(f)
+        with open(self.vehicle_ids_file, 'a', encoding='utf-8') as f:
+            f.writelines(vehicle_id + '\n' for vehicle_id in store.vehicle_ids[self._vehicles_written:])
+            vehicle_ids_offset = f.tell()
+        self._episodes_written = len(store)
+        self._vehicles_written = len(store.vehicle_ids)
+
+        state_file = f"sumo_state_{step + 1}.xml.gz"
+        conn.simulation.saveState(os.path.join(self.directory, state_file))
+
+        vehicle_ids = sorted(controller.assigned_vehicles | controller.stop_times.keys() |
+                             controller.stop_steps.keys())
+        summary_offset = recorder.vehicle_sink.offset() if recorder.vehicle_sink is not None else -1
+        segment_files, segment_starts = zip(*self.segments) if self.segments else ((), ())
+        live_state = {} if recorder.live_totals is None else \
+            {'live_' + name: value for name, value in recorder.live_totals.state().items()}
+        temporary_file = self.checkpoint_file + '.tmp.npz'
+        np.savez(temporary_file, step=step, resume_time=round((step + 1) * controller.steptime, 2),
+                 state_file=state_file, episodes=self._episodes_written, vehicle_ids_offset=vehicle_ids_offset,
+                 summary_offset=summary_offset, total_vehicles_processed=controller.total_vehicles_processed,
+                 vehicle_ids=np.array(vehicle_ids, dtype=str),
+                 assigned=np.array([vehicle_id in controller.assigned_vehicles for vehicle_id in vehicle_ids],
+                                   dtype=bool),
+                 start_stop=np.array([vehicle_id in controller.start_stop_vehicles for vehicle_id in vehicle_ids],
+                                     dtype=bool),
+                 stop_steps=np.array([controller.stop_steps.get(vehicle_id, 0) for vehicle_id in vehicle_ids],
+                                     dtype=np.int32),
+                 stop_times=np.array([controller.stop_times.get(vehicle_id, 0) for vehicle_id in vehicle_ids],
+                                     dtype=np.float64),
+                 rate_rows=np.array([controller.vehicle_rates.get(vehicle_id, 0) for vehicle_id in vehicle_ids],
+                                    dtype=np.int32),
+                 segment_files=np.array(segment_files, dtype=str),
+                 segment_starts=np.array(segment_starts, dtype=np.float64), **live_state)
+        # The checkpoint is only replaced once it is complete
+        os.replace(temporary_file, self.checkpoint_file)
+
+        # The SUMO state of the previous checkpoint is no longer needed
+        previous_state_file = self.state_file
+        self.state_file = os.path.join(self.directory, state_file)
+        if previous_state_file is not None and previous_state_file != self.state_file and \
+                os.path.exists(previous_state_file):
+            os.remove(previous_state_file)
+
+        end = time.perf_counter()
+        self.times.append(end - start)
+        state_size = os.path.getsize(self.state_file) if os.path.exists(self.state_file) else 0
+        self.sizes.append(appended + os.path.getsize(self.checkpoint_file) + state_size)
+        # Checkpoint less often if the checkpoints take more than their share of the wall time
+        if end - start > self.max_overhead * (start - self._last_wall_time):
+            self.interval *= 2
+        self._last_wall_time = end
+        self._last_step = step
+
+    def merge_emission_output(self, emissions_file):
+        """
+         Merges the emission dumps of a resumed run into the emissions_file and removes the segments.
+        """
+        if len(self.segments) > 1:
+            Stp.merge_emission_dumps(self.segments, emissions_file)
+            for segment_file, start_time in self.segments[1:]:
+                os.remove(segment_file)
+            self.segments = [(emissions_file, 0.0)]
+
+    def summary(self):
+        """
+         Returns the summary of the checkpoints of the run as a dictionary.
+        """
+        count = len(self.times)
+        return {'checkpoints': count,
+                'total_time': sum(self.times),
+                'mean_time': sum(self.times) / count if count else 0.0,
+                'max_time': max(self.times, default=0.0),
+                'mean_bytes': sum(self.sizes) / count if count else 0,
+                'interval': self.interval}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Checkpoints: {summary['checkpoints']}, total time: {summary['total_time']:.3f} s, "
+              f"mean: {summary['mean_time'] * 1e3:.3f} ms, max: {summary['max_time'] * 1e3:.3f} ms, "
+              f"mean size: {summary['mean_bytes'] / 2 ** 10:.1f} KiB, final interval: {summary['interval']} steps")
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import traci
+import traci.constants as tc
+import startstop as Stp
+
+"""
+ Co-simulation support: the start-stop model as one of several TraCI clients of the same SUMO instance (eg. next to
+ signal control or a routing service).
+ - StartStopListener runs the model inside the loop of another client, registered with traci.addStepListener.
+ - AsyncStartStopClient is an own client of a SUMO instance started with --num-clients, connected with connect().
+ Both measure the time the start-stop processing adds to every step, so it can be checked against a budget.
+"""
+
+
+class OverheadMeter:
+    """
+     Per-step overhead of the start-stop processing in seconds, compared with an optional budget.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.times = []
+
+    def record(self, seconds):
+        self.times.append(seconds)
+
+    def summary(self):
+        times = sorted(self.times)
+        steps = len(times)
+        return {'steps': steps,
+                'mean': sum(times) / steps if steps else 0.0,
+                'p95': times[int(0.95 * (steps - 1))] if steps else 0.0,
+                'max': times[-1] if steps else 0.0,
+                'budget': self.budget,
+                'over_budget': sum(1 for value in times if value > self.budget) if self.budget is not None else 0}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Start-stop overhead per step: mean {summary['mean'] * 1e3:.3f} ms, "
+              f"p95 {summary['p95'] * 1e3:.3f} ms, max {summary['max'] * 1e3:.3f} ms")
+        if self.budget is not None:
+            print(f"Steps over the {self.budget * 1e3:.3f} ms budget: {summary['over_budget']} of {summary['steps']}")
+
+
+class StartStopListener(traci.StepListener):
+    """
+     Step listener applying the start-stop model after every simulation step of the client that owns the loop:
+     traci.addStepListener(StartStopListener(conn, recorder)). The owner has to advance the simulation one step per
+     simulationStep call, since the listener is called once per call.
+     The listener shares the connection with the owner, so by default it polls the vehicle values and leaves the
+     subscriptions to the owner. With use_subscriptions, only the vehicles the listener subscribed itself are
+     processed; the owner must then not subscribe these vehicles on the same connection, since a new subscription of a
+     vehicle replaces its subscribed variables (a ValueError is raised when a subscription was replaced).
+     :param conn: The TraCI connection the listener reads the vehicle values with.
+     :param recorder: The StartStopRecorder of the run.
+     :param use_subscriptions: If True, the vehicle values are read with subscriptions instead of polling.
+     :param budget: Optional overhead budget per step in seconds.
+     :param first_step: The index of the first step the listener is called after.
+    """
+
+    def __init__(self, conn, recorder, use_subscriptions=False, budget=None, first_step=0):
+        self.conn = conn
+        self.recorder = recorder
+        self.use_subscriptions = use_subscriptions
+        self.overhead = OverheadMeter(budget)
+        self.step_index = first_step
+        self._subscribed = set()  # The vehicles subscribed by the listener
+
+    def _own_values(self, vehicle_values):
+        """
+         Returns the subscription results of the vehicles the listener subscribed itself. The results also hold the
+         subscriptions of the owner of the connection, which are left out.
+        """
+        variables = Stp.SUBSCRIBED_VARIABLES + [tc.VAR_ROAD_ID] if self.recorder.read_road else \
+            Stp.SUBSCRIBED_VARIABLES
+        subscribed = self._subscribed
+        own_values = {}
+        for vehicle_id, values in vehicle_values.items():
+            if vehicle_id in subscribed:
+                if any(variable not in values for variable in variables):
+                    raise ValueError(f"The subscription of vehicle {vehicle_id} was replaced by another subscription "
+                                     f"on the same connection, use the listener without subscriptions.")
+                own_values[vehicle_id] = values
+        return own_values
+
+    def step(self, t=0):
+        start = time.perf_counter()
+        departed, vehicle_values, arrived = Stp.read_step(self.conn, self.use_subscriptions, self.recorder.read_road)
+        if self.use_subscriptions:
+            self._subscribed.update(departed)
+            vehicle_values = self._own_values(vehicle_values)
+            self._subscribed.difference_update(arrived)
+        for vehicle_id in self.recorder.process_step(self.step_index, departed, vehicle_values, arrived):
+            self.conn.vehicle.setColor(vehicle_id, (255, 0, 0, 255))
+        self.step_index += 1
+        self.overhead.record(time.perf_counter() - start)
+        return True
+
+    def cleanUp(self):
+        self.recorder.finish()
+
+
+class AsyncStartStopClient:
+    """
+     Start-stop client of a SUMO instance shared with other TraCI clients. Every TraCI call runs in one dedicated
+     thread, and the next simulation step is requested before the values of the previous step are processed. The
+     start-stop processing therefore overlaps with SUMO and the other clients computing the next step, instead of
+     holding back the step of every client. The vehicle values come with the step response as subscription
+     results, so a step costs a single request apart from subscribing the departed vehicles.
+     :param conn: The TraCI connection of the client (see connect).
+     :param recorder: The StartStopRecorder of the run.
+     :param budget: Optional overhead budget per step in seconds.
+    """
+
+    def __init__(self, conn, recorder, budget=None):
+        self.conn = conn
+        self.recorder = recorder
+        self.overhead = OverheadMeter(budget)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._arrived = set()  # The vehicles that arrived in the last step SUMO executed
+
+    def _advance(self):
+        self.conn.simulationStep()
+        departed, vehicle_values, arrived = Stp.read_step(self.conn, True, self.recorder.read_road)
+        self._arrived = set(arrived)
+        # The subscription results are cleared by the next step, which is requested before they are processed
+        return departed, dict(vehicle_values), arrived
+
+    def _highlight(self, vehicle_ids):
+        # The highlighting runs after the next step, the vehicles that arrived in it are no longer in the network
+        for vehicle_id in vehicle_ids:
+            if vehicle_id not in self._arrived:
+                self.conn.vehicle.setColor(vehicle_id, (255, 0, 0, 255))
+
+    async def run(self, steps):
+        """
+         Runs the client for the given number of steps.
+         :return: The stop episodes of the run (StopEpisodes).
+        """
+        loop = asyncio.get_running_loop()
+        highlight = None
+        try:
+            pending = loop.run_in_executor(self.executor, self._advance)
+            for i in range(steps):
+                departed, vehicle_values, arrived = await pending
+                if i + 1 < steps:
+                    pending = loop.run_in_executor(self.executor, self._advance)
+
+                start = time.perf_counter()
+                highlighted = self.recorder.process_step(i, departed, vehicle_values, arrived)
+                self.overhead.record(time.perf_counter() - start)
+                if highlight is not None:
+                    # Raises the errors of the previous highlighting, which ran right after the step awaited above
+                    await highlight
+                    highlight = None
+                if highlighted:
+                    # Queued behind the pending step, the TraCI thread sends it when the step returned
+                    highlight = loop.run_in_executor(self.executor, self._highlight, highlighted)
+            if highlight is not None:
+                await highlight
+        finally:
+            self.executor.shutdown(wait=True)
+        self.recorder.finish()
+        return self.recorder.episodes
+
+
+def connect(port, order, label="start-stop", host="localhost"):
+    """
+     A function to connect to a SUMO instance started with --num-clients as one of its clients.
+     :param port: The port of the SUMO instance (--remote-port).
+     :param order: The position of the client in the execution order of the clients in every step.
+     :param label: The label of the TraCI connection.
+     :param host: The host of the SUMO instance.
+     :return: The TraCI connection.
+    """
+    traci.init(port, host=host, label=label, doSwitch=False)
+    conn = traci.getConnection(label)
+    conn.setOrder(order)
+    return conn
+
+
+def run_client(port, order, duration, steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+               idle_values=None, engine_off_threshold=Stp.ENGINE_OFF_THRESHOLD, budget=None, live_totals=None,
+               assignment_seed=None, idle_rates=None):
+    """
+     A function to run the start-stop model as an asynchronous client of a shared SUMO instance.
+     :return: The stop episodes of the run (StopEpisodes) and the OverheadMeter of the client.
+    """
+    conn = connect(port, order)
+    controller = Stp.StartStopController(steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+                                         Stp.complete_idle_values(idle_values), engine_off_threshold, assignment_seed,
+                                         idle_rates)
+    emission_classes = None if idle_rates is None else Stp.EmissionClassCache(conn)
+    client = AsyncStartStopClient(conn, Stp.StartStopRecorder(controller, live_totals=live_totals,
+                                                              emission_classes=emission_classes), budget)
+    try:
+        episodes = asyncio.run(client.run(int(duration / steptime)))
+    finally:
+        conn.close()
+    client.overhead.print_summary()
+    return episodes, client.overhead
@@ -0,0 +1,177 @@
+import json
+import os
+import numpy as np
+from emission_store import IdIndex
+from xml_stream import iter_timesteps
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""
+ Columnar binary storage of SUMO emission dumps. Every vehicle step is a row with the time, the vehicle, the lane, the
+ speed and the five emission values. Three formats are supported:
+ - raw: a folder with one binary file per column and a meta.json, the columns are memory-mapped when loaded
+ - npz: a single NumPy archive
+ - parquet: a Parquet file, if pyarrow is installed
+"""
+
+EMISSION_COLUMNS = ['CO2', 'CO', 'HC', 'NOx', 'PMx']
+COLUMN_TYPES = {'time': np.float64, 'vehicle': np.int32, 'lane': np.int32, 'speed': np.float64,
+                **{column: np.float64 for column in EMISSION_COLUMNS}}
+ARRAY_FORMATS = {'raw': '.arrays', 'npz': '.npz', 'parquet': '.parquet'}
+
+
+def array_path(xml_file, array_format):
+    """
+     Returns the path of the binary counterpart of an emission dump, eg. emissions_default.arrays for the raw format.
+    """
+    return os.path.splitext(xml_file)[0] + ARRAY_FORMATS[array_format]
+
+
+class EmissionArrayWriter:
+    """
+     Writes vehicle steps into a columnar binary file. The rows are buffered and flushed in chunks, the raw and the
+     Parquet formats are written incrementally, the npz format is written when the writer is closed.
+     :param path: The path of the output (a folder for the raw format).
+     :param array_format: 'raw', 'npz' or 'parquet'.
+     :param chunk_size: Number of buffered rows before a flush.
+    """
+
+    def __init__(self, path, array_format='raw', chunk_size=65536):
+        if array_format not in ARRAY_FORMATS:
+            raise ValueError(f"Unknown array format: {array_format}")
+        if array_format == 'parquet' and pyarrow is None:
+            raise ImportError("The parquet format needs pyarrow to be installed.")
+        self.path = path
+        self.array_format = array_format
+        self.chunk_size = chunk_size
+        self.vehicles = IdIndex()
+        self.lanes = IdIndex()
+        self.rows = 0
+        self._buffer = {column: [] for column in COLUMN_TYPES}
+        self._chunks = {column: [] for column in COLUMN_TYPES}
+        self._files = None
+        self._parquet_writer = None
+        if array_format == 'raw':
+            os.makedirs(path, exist_ok=True)
+            self._files = {column: open(os.path.join(path, column + '.bin'), 'wb') for column in COLUMN_TYPES}
+
+    def add(self, time, vehicle_id, lane_id, speed, emissions):
+        """
+         Adds the row of a vehicle step.
+         :param emissions: The five emission values in CO2, CO, HC, NOx, PMx order.
+        """
+        buffer = self._buffer
+        buffer['time'].append(time)
+        buffer['vehicle'].append(self.vehicles.intern(vehicle_id))
+        buffer['lane'].append(self.lanes.intern(lane_id))
+        buffer['speed'].append(speed)
+        for column, value in zip(EMISSION_COLUMNS, emissions):
+            buffer[column].append(value)
+        if len(buffer['time']) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+         Writes the buffered rows.
+        """
+        count = len(self._buffer['time'])
+        if count == 0:
+            return
+        chunk = {column: np.array(values, dtype=COLUMN_TYPES[column]) for column, values in self._buffer.items()}
+        self._buffer = {column: [] for column in COLUMN_TYPES}
+        self.rows += count
+        if self.array_format == 'raw':
+            for column, values in chunk.items():
+                values.tofile(self._files[column])
+        elif self.array_format == 'parquet':
+            table = pyarrow.table(chunk)
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            for column, values in chunk.items():
+                self._chunks[column].append(values)
+
+    def close(self):
+        """
+         Flushes the remaining rows and writes the id tables.
+        """
+        self.flush()
+        if self.array_format == 'raw':
+            for f in self._files.values():
+                f.close()
+            meta = {'rows': self.rows, 'columns': {column: np.dtype(dtype).str for column, dtype in COLUMN_TYPES.items()},
+                    'vehicle_ids': self.vehicles.ids, 'lane_ids': self.lanes.ids}
+            with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        elif self.array_format == 'parquet':
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(
+                    self.path, pyarrow.schema([(column, pyarrow.from_numpy_dtype(dtype))
+                                               for column, dtype in COLUMN_TYPES.items()]))
+            self._parquet_writer.close()
+            with open(self.path + '.ids.json', 'w') as f:
+                json.dump({'vehicle_ids': self.vehicles.ids, 'lane_ids': self.lanes.ids}, f)
+        else:
+            columns = {column: np.concatenate(chunks) if chunks else np.empty(0, dtype=COLUMN_TYPES[column])
+                       for column, chunks in self._chunks.items()}
+            np.savez(self.path, vehicle_ids=np.array(self.vehicles.ids, dtype=str),
+                     lane_ids=np.array(self.lanes.ids, dtype=str), **columns)
+
+
+def load_emission_arrays(path):
+    """
+     A function to load a columnar emission file. The columns of the raw format are memory-mapped, so they are only
+     read from the disk when they are used.
+     :param path: The path of the file (the folder for the raw format).
+     :return: Dictionary of the columns, and the 'vehicle_ids' and 'lane_ids' tables the vehicle and lane columns
+      refer to.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {column: np.memmap(os.path.join(path, column + '.bin'), dtype=np.dtype(dtype), mode='r',
+                                    shape=(meta['rows'],)) if meta['rows'] else np.empty(0, dtype=np.dtype(dtype))
+                  for column, dtype in meta['columns'].items()}
+        arrays['vehicle_ids'] = meta['vehicle_ids']
+        arrays['lane_ids'] = meta['lane_ids']
+        return arrays
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError("Reading the parquet format needs pyarrow to be installed.")
+        table = pyarrow.parquet.read_table(path, memory_map=True)
+        arrays = {column: table.column(column).to_numpy() for column in table.column_names}
+        with open(path + '.ids.json') as f:
+            arrays.update(json.load(f))
+        return arrays
+    with np.load(path) as archive:
+        arrays = {name: archive[name] for name in archive.files}
+    arrays['vehicle_ids'] = arrays['vehicle_ids'].tolist()
+    arrays['lane_ids'] = arrays['lane_ids'].tolist()
+    return arrays
+
+
+def convert_emission_dump(xml_file, path=None, array_format='raw'):
+    """
+     A function to convert a SUMO emission dump into a columnar emission file. The dump is streamed one timestep
+     at a time.
+     :param xml_file: The SUMO emission dump.
+     :param path: The path of the output, by default next to the dump (see array_path).
+     :param array_format: 'raw', 'npz' or 'parquet'.
+     :return: The path of the output.
+    """
+    if path is None:
+        path = array_path(xml_file, array_format)
+    writer = EmissionArrayWriter(path, array_format)
+    for timestep in iter_timesteps(xml_file):
+        time = float(timestep.attrib['time'])
+        for vehicle in timestep.iter('vehicle'):
+            attrib = vehicle.attrib
+            writer.add(time, attrib['id'], attrib.get('lane', ''), float(attrib.get('speed', 0)),
+                       [float(attrib[column]) for column in EMISSION_COLUMNS])
+    writer.close()
+    return path
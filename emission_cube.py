@@ -0,0 +1,274 @@
+import csv
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import matplotlib.pyplot as plt
+from emission_arrays import EMISSION_COLUMNS, load_emission_arrays
+import startstop as Stp
+from xml_stream import iter_timesteps
+
+"""
+ Spatial and temporal aggregation of the emissions for hotspot analysis. The emissions of the non start-stop and the
+ start-stop case are summed up per edge (or lane), time bin and emission type into dense NumPy arrays, so slices,
+ hotspots and heatmaps are answered from the arrays without reading the emission dumps again.
+ The cube is filled while the start-stop dump is written (create_start_stop_emissions), in the simulation loop
+ (LiveEmissionTotals), or afterwards from the emission dumps or their columnar files.
+"""
+
+LAYERS = ('default', 'start_stop')
+
+
+def network_location_count(sumocfg, level='edge'):
+    """
+     A function to count the edges (or lanes) of the networks of a SUMO configuration, including the internal edges
+     of the junctions, which also appear in the emission output. The networks are streamed one edge at a time.
+     :param sumocfg: The SUMO configuration file.
+     :param level: 'edge' or 'lane'.
+     :return: The number of locations of the level, 0 if the configuration has no network file.
+    """
+    count = 0
+    config_dir = os.path.dirname(os.path.abspath(sumocfg))
+    for net_file in ET.parse(sumocfg).getroot().iter('net-file'):
+        for file_name in net_file.attrib.get('value', '').split(','):
+            root = None
+            for event, element in ET.iterparse(os.path.join(config_dir, file_name.strip()), events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = element
+                elif element.tag == 'edge':
+                    count += len(element.findall('lane')) if level == 'lane' else 1
+                    # Release the counted edge
+                    root.clear()
+    return count
+
+
+def edge_of_lane(lane_id):
+    """
+     Returns the edge of a SUMO lane id, the lane index is the part after the last underscore (eg. E1_0 -> E1,
+     :J0_2_0 -> :J0_2).
+    """
+    return lane_id.rsplit('_', 1)[0] if lane_id else lane_id
+
+
+class EmissionCube:
+    """
+     Emissions per location (edge or lane), time bin and emission type, for the non start-stop and the start-stop
+     case. The data is one array (layers x locations x time bins x emission types); the locations are indexed in the
+     order of their first appearance. A cube takes 16 bytes per location, time bin and emission type (80 bytes per
+     location and time bin), eg. 192 MB for 100k edges and hourly bins over a day, or 768 MB with 15 minute bins.
+     The array is allocated with the given capacities, which should hold every location of the network (see
+     network_location_count) and every time bin of the run. An axis that runs out of capacity is doubled, which
+     copies the cube and may allocate up to twice the needed memory.
+     :param bin_size: The length of a time bin in seconds.
+     :param level: 'edge' or 'lane', the level the lanes of the emission output are aggregated to.
+     :param location_capacity: The number of locations the cube is allocated for.
+     :param bin_capacity: The number of time bins the cube is allocated for.
+    """
+
+    def __init__(self, bin_size=900, level='edge', location_capacity=1024, bin_capacity=16):
+        if level not in ('edge', 'lane'):
+            raise ValueError(f"Unknown aggregation level: {level}")
+        self.bin_size = bin_size
+        self.level = level
+        self.location_ids = []
+        self.location_indices = {}
+        self.bin_count = 0
+        self._lane_locations = {}
+        self._data = np.zeros((len(LAYERS), location_capacity, bin_capacity, len(EMISSION_COLUMNS)))
+
+    @property
+    def data(self):
+        """The filled part of the cube (layers x locations x time bins x emission types)."""
+        return self._data[:, :len(self.location_ids), :self.bin_count]
+
+    def location_index(self, location_id):
+        """
+         Returns the index of a location of the cube level, the location is added if it is new.
+        """
+        index = self.location_indices.get(location_id)
+        if index is None:
+            index = self.location_indices[location_id] = len(self.location_ids)
+            self.location_ids.append(location_id)
+        return index
+
+    def lane_index(self, lane_id):
+        """
+         Returns the location index of a lane of the emission output, aggregated to the cube level.
+        """
+        index = self._lane_locations.get(lane_id)
+        if index is None:
+            index = self._lane_locations[lane_id] = self.location_index(
+                edge_of_lane(lane_id) if self.level == 'edge' else lane_id)
+        return index
+
+    def _reserve(self, location_count, bin_count):
+        layers, location_capacity, bin_capacity, emission_count = self._data.shape
+        if location_count <= location_capacity and bin_count <= bin_capacity:
+            return
+        location_capacity = max(location_capacity, 1)
+        bin_capacity = max(bin_capacity, 1)
+        while location_capacity < location_count:
+            location_capacity *= 2
+        while bin_capacity < bin_count:
+            bin_capacity *= 2
+        data = np.zeros((layers, location_capacity, bin_capacity, emission_count))
+        data[:, :self._data.shape[1], :self._data.shape[2]] = self._data
+        self._data = data
+
+    def add_rows(self, layer, times, locations, values):
+        """
+         Adds vehicle steps to a layer.
+         :param layer: 'default' or 'start_stop'.
+         :param times: The times of the vehicle steps in seconds.
+         :param locations: The location indices of the vehicle steps (see location_index and lane_index).
+         :param values: The emission values of the vehicle steps (vehicle steps x emission types).
+        """
+        locations = np.asarray(locations, dtype=np.intp)
+        if len(locations) == 0:
+            return
+        bins = (np.asarray(times, dtype=np.float64) // self.bin_size).astype(np.intp)
+        self.bin_count = max(self.bin_count, int(bins.max()) + 1)
+        self._reserve(len(self.location_ids), self.bin_count)
+        np.add.at(self._data[LAYERS.index(layer)], (locations, bins), np.asarray(values, dtype=np.float64))
+
+    def add_step(self, time, locations, default_values, start_stop_values):
+        """
+         Adds the vehicle steps of one timestep to both layers.
+        """
+        times = np.full(len(locations), time)
+        self.add_rows('default', times, locations, default_values)
+        self.add_rows('start_stop', times, locations, start_stop_values)
+
+    def add_arrays(self, path, layer, chunk_size=1 << 20):
+        """
+         Adds a columnar emission file (see emission_arrays) to a layer. The columns are processed in chunks, so
+         memory-mapped files are never loaded at once.
+        """
+        arrays = load_emission_arrays(path)
+        lane_locations = np.array([self.lane_index(lane_id) for lane_id in arrays['lane_ids']], dtype=np.intp)
+        for start in range(0, len(arrays['time']), chunk_size):
+            end = start + chunk_size
+            values = np.column_stack([arrays[column][start:end] for column in EMISSION_COLUMNS])
+            self.add_rows(layer, arrays['time'][start:end], lane_locations[arrays['lane'][start:end]], values)
+
+    def add_dump(self, emissions_file, layer):
+        """
+         Streams a SUMO emission dump into a layer, one timestep at a time.
+        """
+        for timestep in iter_timesteps(emissions_file):
+            vehicles = list(timestep.iter('vehicle'))
+            self.add_rows(layer, np.full(len(vehicles), float(timestep.attrib['time'])),
+                          [self.lane_index(vehicle.attrib.get('lane', '')) for vehicle in vehicles],
+                          np.array([Stp.read_emissions(vehicle) for vehicle in vehicles],
+                                   dtype=np.float64).reshape(-1, len(EMISSION_COLUMNS)))
+
+    def restore(self, data, location_ids):
+        """
+         Replaces the content of the cube with the given data (layers x locations x time bins x emission types) of the
+         given locations, keeping the allocated capacity if it is large enough.
+        """
+        self.location_ids = []
+        self.location_indices = {}
+        self._lane_locations = {}
+        for location_id in location_ids:
+            self.location_index(location_id)
+        self.bin_count = data.shape[2]
+        self._data[...] = 0
+        self._reserve(len(self.location_ids), self.bin_count)
+        self._data[:, :data.shape[1], :self.bin_count] = data
+
+    def bin_starts(self):
+        """Returns the start times of the time bins in seconds."""
+        return np.arange(self.bin_count) * self.bin_size
+
+    def _bin_range(self, start, end):
+        first = 0 if start is None else int(start // self.bin_size)
+        last = self.bin_count if end is None else int(np.ceil(end / self.bin_size))
+        return slice(max(first, 0), min(last, self.bin_count))
+
+    def select(self, layer='delta', locations=None, start=None, end=None, emission_type=None):
+        """
+         Returns a slice of a layer: 'default', 'start_stop', or 'delta' for the start-stop minus the non start-stop
+         emissions.
+         :param locations: List of location ids, None selects every location.
+         :param start: Start time in seconds, the time bins overlapping [start, end) are selected.
+         :param end: End time in seconds.
+         :param emission_type: One emission type (eg. 'CO2'), None selects every type.
+         :return: Array (locations x time bins x emission types), without the emission type axis if one is given.
+        """
+        data = self.data[:, :, self._bin_range(start, end)]
+        if locations is not None:
+            data = data[:, [self.location_indices[location_id] for location_id in locations]]
+        if emission_type is not None:
+            data = data[..., EMISSION_COLUMNS.index(emission_type)]
+        # The delta is only computed for the selected part of the cube
+        if layer == 'delta':
+            return data[1] - data[0]
+        return data[LAYERS.index(layer)]
+
+    def location_totals(self, layer='delta', start=None, end=None):
+        """
+         Returns the emissions of every location summed up over the time bins in [start, end) (locations x types).
+        """
+        return self.select(layer, start=start, end=end).sum(axis=1)
+
+    def hotspots(self, emission_type='CO2', layer='delta', count=10, start=None, end=None):
+        """
+         Returns the count locations with the largest absolute emissions of the emission type in [start, end).
+         :return: List of (location id, emissions) pairs in descending order of the absolute emissions.
+        """
+        totals = self.location_totals(layer, start, end)[:, EMISSION_COLUMNS.index(emission_type)]
+        count = min(count, len(totals))
+        if count == 0:
+            return []
+        top = np.argpartition(-np.abs(totals), count - 1)[:count]
+        top = top[np.argsort(-np.abs(totals[top]), kind='stable')]
+        return [(self.location_ids[index], float(totals[index])) for index in top]
+
+    def write_csv(self, csv_file):
+        """
+         Writes the non-empty cells into a CSV file, one row per location, time bin and emission type.
+        """
+        default, start_stop = self.data
+        locations, bins, types = np.nonzero((default != 0) | (start_stop != 0))
+        with open(csv_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([self.level, 'bin_start', 'emission_type', 'default', 'start_stop', 'delta'])
+            for location, bin, type in zip(locations.tolist(), bins.tolist(), types.tolist()):
+                default_value = default[location, bin, type]
+                start_stop_value = start_stop[location, bin, type]
+                writer.writerow([self.location_ids[location], bin * self.bin_size, EMISSION_COLUMNS[type],
+                                 default_value, start_stop_value, start_stop_value - default_value])
+
+    def save(self, path):
+        """
+         Writes the cube into a NumPy archive (see load_emission_cube).
+        """
+        np.savez(path, data=self.data, location_ids=np.array(self.location_ids, dtype=str),
+                 bin_size=self.bin_size, level=self.level)
+
+    def plot_heatmap(self, emission_type='CO2', layer='delta', count=30):
+        """
+         Shows the emissions of the count hotspot locations over time as a heatmap.
+        """
+        locations = [location_id for location_id, value in self.hotspots(emission_type, layer, count)]
+        values = self.select(layer, locations, emission_type=emission_type)
+        plt.imshow(values, aspect='auto', cmap='coolwarm' if layer == 'delta' else 'viridis', interpolation='nearest',
+                   extent=(0, self.bin_count * self.bin_size, len(locations), 0))
+        plt.yticks(np.arange(len(locations)) + 0.5, locations)
+        plt.colorbar(label=f'{emission_type} [mg]')
+        plt.title(f'{emission_type} per {self.level} and time bin ({layer})')
+        plt.xlabel('Time [s]')
+        plt.ylabel(self.level.capitalize())
+        plt.show()
+
+
+def load_emission_cube(path):
+    """
+     A function to load an EmissionCube written with EmissionCube.save.
+    """
+    with np.load(path) as archive:
+        data = archive['data']
+        cube = EmissionCube(float(archive['bin_size']), str(archive['level']), data.shape[1], data.shape[2])
+        cube.restore(data, archive['location_ids'].tolist())
+    return cube
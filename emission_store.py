@@ -0,0 +1,180 @@
+import heapq
+import numpy as np
+
+EMISSION_COUNT = 5
+# Binary layout of a stop episode in files (see StopEpisodes.rows and StopEpisodes.restore)
+EPISODE_TYPE = np.dtype([('vehicle', '<i4'), ('start', '<i4'), ('end', '<i4'), ('engine_off', '<i4'),
+                         ('penalty', '<f8', (EMISSION_COUNT,))])
+
+
+class IdIndex:
+    """
+     Interning of string ids (eg. vehicle or lane ids) into consecutive integer indices, so that columns and binary
+     files store an integer per row instead of the id.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = list(ids)
+        self.indices = {id: index for index, id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, id):
+        """
+         Returns the integer index of the id, registering the id on its first use.
+        """
+        index = self.indices.get(id)
+        if index is None:
+            index = self.indices[id] = len(self.ids)
+            self.ids.append(id)
+        return index
+
+
+class StopEpisodes:
+    """
+     Event-based storage of the start-stop emission data. Instead of a record per step, every stop of a start-stop
+     vehicle that changes its emissions is stored once as an episode: the vehicle index, the first step of the stop,
+     the step the vehicle moves again (end, exclusive), the first step with the engine switched off and the restart
+     penalty added to the emissions of the end step. The engine is off in [engine_off, end); a stop that is still
+     running when the vehicle leaves the network or the simulation ends has no restart and a zero penalty. An episode
+     costs 56 bytes however long the stop is, so long stops at small step lengths need far less memory than records.
+    """
+
+    def __init__(self, steptime, capacity=1024):
+        self.steptime = steptime
+        self.vehicles = IdIndex()
+        self.episodes = np.empty(capacity, dtype=EPISODE_TYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vehicle_ids(self):
+        """The vehicle ids of the vehicle indices of the episodes."""
+        return self.vehicles.ids
+
+    def add(self, vehicle_id, start, end, engine_off, penalty):
+        """
+         Stores a stop episode.
+         :param vehicle_id: The SUMO vehicle id.
+         :param start: The index of the first step of the stop.
+         :param end: The index of the step the vehicle moves again, or of the first step it is no longer simulated.
+         :param engine_off: The index of the first step with the engine switched off, end if it was never off.
+         :param penalty: The five restart penalty values in CO2, CO, HC, NOx, PMx order.
+        """
+        if self.size == len(self.episodes):
+            self.episodes = np.resize(self.episodes, 2 * len(self.episodes))
+        self.episodes[self.size] = (self.vehicles.intern(vehicle_id), start, end, engine_off, penalty)
+        self.size += 1
+
+    def rows(self, start=0):
+        """
+         Returns the episodes from the given row on as a structured array of EPISODE_TYPE.
+        """
+        return self.episodes[start:self.size].copy()
+
+    def restore(self, vehicle_ids, rows):
+        """
+         Replaces the content of the store with the given vehicle ids and episodes of EPISODE_TYPE (see rows).
+        """
+        self.vehicles = IdIndex(vehicle_ids)
+        self.episodes = np.empty(max(len(rows), 1024), dtype=EPISODE_TYPE)
+        self.size = len(rows)
+        self.episodes[:self.size] = rows
+
+    def step_of(self, time):
+        """
+         Returns the index of the simulation step at the given time in seconds.
+        """
+        return int(round(time / self.steptime))
+
+    def record_count(self):
+        """
+         Returns the number of per-step records the episodes stand for (engine-off steps and restarts).
+        """
+        episodes = self.episodes[:self.size]
+        restarts = np.count_nonzero(np.any(episodes['penalty'] != 0, axis=1))
+        return int(np.sum(episodes['end'] - episodes['engine_off'])) + restarts
+
+    def engine_off_durations(self):
+        """
+         Returns the engine-off duration of every episode with the engine switched off in seconds.
+        """
+        episodes = self.episodes[:self.size]
+        steps = episodes['end'] - episodes['engine_off']
+        return steps[steps > 0] * self.steptime
+
+    def engine_off_histogram(self, bin_size=5.0):
+        """
+         Returns the histogram of the engine-off durations.
+         :param bin_size: The width of the bins in seconds.
+         :return: The episode counts and the bin edges in seconds.
+        """
+        durations = self.engine_off_durations()
+        bin_count = max(int(np.ceil(durations.max() / bin_size)) if len(durations) else 0, 1)
+        return np.histogram(durations, bins=np.arange(bin_count + 1) * bin_size)
+
+    def timeline(self):
+        """
+         Returns an EpisodeTimeline applying the episodes to the steps of an emission dump.
+        """
+        return EpisodeTimeline(self)
+
+    def nbytes(self):
+        """
+         Returns the memory used by the allocated episodes in bytes.
+        """
+        return self.episodes.nbytes
+
+
+class EpisodeTimeline:
+    """
+     Merges the engine-off intervals of StopEpisodes with the steps of an emission dump, which are visited in
+     ascending order. The intervals are started in the order of their engine-off step and kept in a heap by their end,
+     so a step costs the intervals starting and ending in it instead of a search through every episode.
+    """
+
+    def __init__(self, episodes):
+        self.vehicle_ids = episodes.vehicle_ids
+        self.episodes = episodes.episodes[:episodes.size]
+        engine_off = self.episodes['engine_off'] < self.episodes['end']
+        self._starts = np.flatnonzero(engine_off)[np.argsort(self.episodes['engine_off'][engine_off], kind='stable')]
+        restarted = np.flatnonzero(np.any(self.episodes['penalty'] != 0, axis=1))
+        self._restarts = restarted[np.argsort(self.episodes['end'][restarted], kind='stable')]
+        self._restart_steps = self.episodes['end'][self._restarts]
+        self._reset()
+
+    def _reset(self):
+        self._next_start = 0
+        self._ends = []
+        self.engine_off = set()
+        self._step = None
+
+    def at(self, step):
+        """
+         Advances the timeline to the given step.
+         :return: The set of vehicle ids with the engine switched off and the restart penalties of the step keyed by
+          vehicle id.
+        """
+        if self._step is not None and step < self._step:
+            self._reset()
+        self._step = step
+        episodes = self.episodes
+        vehicle_ids = self.vehicle_ids
+        while self._ends and self._ends[0][0] <= step:
+            self.engine_off.discard(heapq.heappop(self._ends)[1])
+        starts = self._starts
+        while self._next_start < len(starts) and episodes['engine_off'][starts[self._next_start]] <= step:
+            episode = episodes[starts[self._next_start]]
+            self._next_start += 1
+            if episode['end'] > step:
+                vehicle_id = vehicle_ids[episode['vehicle']]
+                heapq.heappush(self._ends, (int(episode['end']), vehicle_id))
+                self.engine_off.add(vehicle_id)
+        first = np.searchsorted(self._restart_steps, step, side='left')
+        last = np.searchsorted(self._restart_steps, step, side='right')
+        rows = episodes[self._restarts[first:last]]
+        return self.engine_off, {vehicle_ids[vehicle]: penalty
+                                 for vehicle, penalty in zip(rows['vehicle'].tolist(), rows['penalty'].tolist())}
@@ -0,0 +1,135 @@
+import argparse
+import csv
+import os
+import tempfile
+import numpy as np
+import traci
+import startstop as Stp
+
+"""
+ Idle emission rates per SUMO emission class. The restart penalty of a start-stop vehicle is computed from the idle
+ rates of its emission class instead of one global set of idle values, so mixed fleets get their own penalties.
+ The rates are read from a CSV file (idle_rates.csv is bundled with the rates of HBEFA4/PC_petrol_Euro-4), and the
+ rates of further classes can be measured by a short calibration run of SUMO.
+ Usage: python idle_rates.py --net examples/net_10.net.xml --edge 1 --classes HBEFA4/PC_diesel_Euro-6
+        --output idle_rates.csv
+"""
+
+IDLE_RATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "idle_rates.csv")
+
+
+class IdleRateTable:
+    """
+     Idle emission rates keyed by emission class. The rates are an array (classes x emission types) whose first row
+     holds the fallback idle values used for the vehicles of unknown classes; the class of a vehicle is turned into
+     its row once and the rates of many vehicles are looked up with one indexing operation.
+     :param class_rates: Dictionary of the idle value dictionaries keyed by emission class.
+     :param default_values: The fallback idle values, None uses the default idle values.
+    """
+
+    def __init__(self, class_rates, default_values=None):
+        default_values = Stp.complete_idle_values(default_values)
+        self.emission_classes = [None] + list(class_rates)
+        self.rows = {emission_class: row for row, emission_class in enumerate(self.emission_classes)}
+        self.rates = np.array([[default_values[type] for type in Stp.EMISSION_TYPES]] +
+                              [[values.get(type, default_values[type]) for type in Stp.EMISSION_TYPES]
+                               for values in class_rates.values()], dtype=np.float64)
+
+    def row(self, emission_class):
+        """
+         Returns the row of the emission class in the rates, the fallback row 0 for unknown classes.
+        """
+        return self.rows.get(emission_class, 0)
+
+    def lookup(self, emission_classes):
+        """
+         Returns the rates of a list of emission classes (emission classes x emission types).
+        """
+        return self.rates[[self.row(emission_class) for emission_class in emission_classes]]
+
+
+def load_idle_rates(csv_file=IDLE_RATES_FILE, default_values=None):
+    """
+     A function to read an IdleRateTable from a CSV file with an emission_class column and a column per emission type.
+    """
+    with open(csv_file, newline='') as f:
+        class_rates = {row['emission_class']: {type: float(row[type]) for type in Stp.EMISSION_TYPES}
+                       for row in csv.DictReader(f)}
+    return IdleRateTable(class_rates, default_values)
+
+
+def write_idle_rates(class_rates, csv_file=IDLE_RATES_FILE):
+    """
+     A function to write idle rates into a CSV file. The classes already in the file are kept unless they are
+     measured again.
+     :param class_rates: Dictionary of the idle value dictionaries keyed by emission class.
+    """
+    rates = {}
+    if os.path.exists(csv_file):
+        with open(csv_file, newline='') as f:
+            rates = {row['emission_class']: {type: float(row[type]) for type in Stp.EMISSION_TYPES}
+                     for row in csv.DictReader(f)}
+    rates.update(class_rates)
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['emission_class'] + Stp.EMISSION_TYPES)
+        for emission_class, values in rates.items():
+            writer.writerow([emission_class] + [values[type] for type in Stp.EMISSION_TYPES])
+
+
+def calibrate_idle_rates(emission_classes, net_file, edge_id, steptime=1.0, steps=10, sumo_binary="sumo"):
+    """
+     A function to measure the idle rates of emission classes in a short SUMO run. A single vehicle is held at
+     standstill on the given edge and switched through the emission classes; the emissions SUMO reports for it are
+     averaged over the given number of steps per class.
+     :param emission_classes: The emission classes to measure.
+     :param net_file: A SUMO network.
+     :param edge_id: An edge of the network the vehicle stands on.
+     :return: Dictionary of the idle value dictionaries keyed by emission class.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        route_file = os.path.join(directory, "idle.rou.xml")
+        with open(route_file, 'w') as f:
+            f.write(f'<routes>\n    <vehicle id="idle" depart="0" departSpeed="0">\n'
+                    f'        <route edges="{edge_id}"/>\n    </vehicle>\n</routes>\n')
+        traci.start([sumo_binary, "-n", net_file, "-r", route_file, "--step-length", str(steptime),
+                     "--no-step-log", "true"], label="idle-calibration")
+        conn = traci.getConnection("idle-calibration")
+        try:
+            conn.simulationStep()
+            conn.vehicle.setSpeed("idle", 0)
+            class_rates = {}
+            for emission_class in emission_classes:
+                conn.vehicle.setEmissionClass("idle", emission_class)
+                # The first step after the switch is not measured
+                conn.simulationStep()
+                sums = np.zeros(len(Stp.EMISSION_TYPES))
+                for i in range(steps):
+                    conn.simulationStep()
+                    sums += [conn.vehicle.getCO2Emission("idle"), conn.vehicle.getCOEmission("idle"),
+                             conn.vehicle.getHCEmission("idle"), conn.vehicle.getNOxEmission("idle"),
+                             conn.vehicle.getPMxEmission("idle")]
+                class_rates[emission_class] = dict(zip(Stp.EMISSION_TYPES, (sums / steps).tolist()))
+        finally:
+            conn.close()
+    return class_rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the idle emission rates of SUMO emission classes.")
+    parser.add_argument("--net", required=True, help="SUMO network the calibration vehicle stands on.")
+    parser.add_argument("--edge", required=True, help="Edge of the network the calibration vehicle stands on.")
+    parser.add_argument("--classes", nargs="+", required=True, help="Emission classes (eg. HBEFA4/PC_diesel_Euro-6).")
+    parser.add_argument("--steps", type=int, default=10, help="Measured steps per emission class.")
+    parser.add_argument("--output", default=IDLE_RATES_FILE, help="CSV file the idle rates are added to.")
+    args = parser.parse_args()
+
+    class_rates = calibrate_idle_rates(args.classes, args.net, args.edge, steps=args.steps)
+    write_idle_rates(class_rates, args.output)
+    for emission_class, values in class_rates.items():
+        print(emission_class, values)
+    print(f"Idle rates written in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+import math
 import os
 import startstop as Stp
+import replay
+from emission_cube import EmissionCube, network_location_count
+from checkpoint import Checkpointer
+from idle_rates import load_idle_rates
 
 """
  Simulation settings: 
@@ -7,19 +12,56 @@ import startstop as Stp
  - sumoCfg: Path to the SUMO simulation's configuration file.
  - start_stop_ratio: Ratio of the start-stop vehicles in the simulation given in %.
  - ratio_based_simulation: If True, the vehicles are assigned to the start-stop vehicles group by the given ratio,
-  otherwise, the vehicle class type "start-stop-vehicle" is used.
+  otherwise, the vehicle class type "start-stop-vehicle" is used. Set it to False for a route file with a precomputed
+  assignment (see assignment.py), whose start-stop vehicles have the start-stop copies of their types.
+ - assignment_seed: If given, the ratio-based assignment hashes the vehicle ids with this seed instead of following
+  the order the vehicles appear in, so every run and replay with the same seed has the same start-stop vehicles.
  - idle_time_in_sec: The amount of time the idle values are considered in seconds
+ - engine_off_threshold: The stop duration in seconds after which the start-stop system switches off the engine
  - idle_values: Dictionary of the idle emission values (CO2, CO, HC, NOx, PMx) based on the 
   HBEFA4/PC_petrol_Euro-4 model. Selected default parameters can be overwritten.
+ - idle_rates_file: If given, the restart penalty of every start-stop vehicle is computed from the idle rates of its
+  emission class in this CSV file (eg. the bundled idle_rates.csv, see idle_rates.py), the idle_values are used for
+  the classes that are not in the file.
+ - use_subscriptions: If True, the vehicle data is collected with TraCI subscriptions (one request per step),
+  otherwise every value is polled with a separate TraCI call.
+ - profile: If True, the simulation loop is instrumented. The per-step trace (profile_trace.csv) and the summary
+  (profile_summary.json) are written to the results folder.
+ - array_format: If 'raw', 'npz' or 'parquet' (needs pyarrow), both emission dumps are also written as columnar
+  binary files (eg. results/emissions_default.arrays) that can be memory-mapped instead of parsing the XML.
+ - live_snapshot_interval: If larger than 0, the cumulative emissions are summed up during the simulation (per
+  emission type, vehicle type and edge) and written to results/live_totals.json every live_snapshot_interval steps.
+ - write_emission_dumps: If False, the XML emission dumps are not written, the cumulative emissions are summed up
+  during the simulation only.
+ - emission_cube_bin_size: If given, the emissions of both cases are also aggregated per edge and time bin of the given
+  size in seconds. The cube is written to results/emission_cube.npz for hotspot analysis (see emission_cube.py).
+ - checkpoint_interval: If larger than 0, the SUMO and the start-stop state are saved to results/checkpoint every
+  checkpoint_interval simulated seconds.
+ - resume_from_checkpoint: If True, an interrupted run continues from its last checkpoint in results/checkpoint.
+ - replay_only: If True, SUMO is not started. The start-stop emissions are computed from the existing
+  results/emissions_default.xml of a previous run with the same SUMO configuration.
 """
 # <-------------------- USER SETTINGS -------------------->
 sumocfg = "examples/cfg_10_free.sumocfg"
 ratio_based_simulation = True
 start_stop_ratio = 80
+assignment_seed = None
 idle_time_in_sec = 7
+engine_off_threshold = 2
 idle_values = None
+idle_rates_file = None
+use_subscriptions = True
+profile = False
+array_format = None
+live_snapshot_interval = 0
+write_emission_dumps = True
+emission_cube_bin_size = None
+checkpoint_interval = 0
+resume_from_checkpoint = False
+replay_only = False
 # Example parameter selection:
 #idle_values = {'CO2': 1.8, 'CO': 3.0126e-12}
+#idle_rates_file = "idle_rates.csv"
 # <-------------------- END OF USER SETTINGS -------------------->
 
 
@@ -37,11 +79,44 @@ def main():
             # Extract the step length size from the given SUMO configuration
             stepsize = float(Stp.extract_step_length(sumocfg))
             duration = float(Stp.extract_duration(sumocfg))
+            idle_rates = load_idle_rates(idle_rates_file, idle_values) if idle_rates_file else None
+
+            if replay_only:
+                print("Replaying results/emissions_default.xml...")
+                default_totals = Stp.EmissionTotals()
+                start_stop_totals = Stp.EmissionTotals()
+                if replay.replay_start_stop(stepsize, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+                                            idle_values, default_totals=default_totals,
+                                            start_stop_totals=start_stop_totals,
+                                            engine_off_threshold=engine_off_threshold,
+                                            assignment_seed=assignment_seed, idle_rates=idle_rates):
+                    print("Start-stop emission data successfully written in results/emissions_start_stop.xml")
+                    Stp.calculate_cumulative_emissions(default_totals, start_stop_totals)
+                return
+
+            cube = None
+            if emission_cube_bin_size:
+                # The cube is allocated once for every edge of the network and every time bin of the simulation
+                cube = EmissionCube(emission_cube_bin_size, location_capacity=network_location_count(sumocfg),
+                                    bin_capacity=math.ceil(duration / emission_cube_bin_size))
+            live_totals = None
+            if live_snapshot_interval > 0:
+                # Without emission dumps, the cube is filled in the simulation loop
+                live_totals = Stp.LiveEmissionTotals(live_snapshot_interval, "results/live_totals.json",
+                                                     cube=None if write_emission_dumps else cube)
+
+            checkpointer = None
+            if checkpoint_interval > 0:
+                checkpointer = Checkpointer("results/checkpoint", max(1, int(round(checkpoint_interval / stepsize))),
+                                            resume_from_checkpoint)
 
             # Start the simulation
             print("Starting SUMO simulation...")
             Stp.run_simulation(sumocfg, duration, stepsize, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
-                               idle_values)
+                               idle_values, use_subscriptions, engine_off_threshold, profile=profile,
+                               array_format=array_format, live_totals=live_totals,
+                               write_dumps=write_emission_dumps, cube=cube, checkpointer=checkpointer,
+                               assignment_seed=assignment_seed, idle_rates=idle_rates)
             return
         else:
             print("The given SUMO configuration file does not exist!")
@@ -0,0 +1,172 @@
+import csv
+import json
+import sys
+import time
+
+"""
+ Opt-in instrumentation of the start-stop simulation loop. The loop only checks whether a profiler is given a few times
+ per step, so a disabled profiler costs practically nothing.
+"""
+
+# Phases of a simulation step, in execution order. The start-stop phase is the state machine of the controller, the
+# bookkeeping phase records its results (stop episodes, live totals, arrived vehicles). The highlight phase colors
+# the start-stop vehicles in the GUI and the checkpoint phase saves a checkpoint, if one is due.
+PHASES = ('simulation_step', 'collection', 'start_stop', 'bookkeeping', 'highlight', 'checkpoint')
+# TraCI domains of a connection, the calls of all of them are counted
+TRACI_DOMAINS = ('busstop', 'calibrator', 'chargingstation', 'edge', 'gui', 'inductionloop', 'junction', 'lane',
+                 'lanearea', 'meandata', 'multientryexit', 'overheadwire', 'parkingarea', 'person', 'poi', 'polygon',
+                 'rerouter', 'route', 'routeprobe', 'simulation', 'trafficlight', 'variablespeedsign', 'vehicle',
+                 'vehicletype')
+
+
+def counted(function, profiler):
+    """
+     Returns the function wrapped so that its calls are counted as TraCI calls of the profiler.
+    """
+    def counting_function(*args, **kwargs):
+        profiler.traci_calls += 1
+        return function(*args, **kwargs)
+    return counting_function
+
+
+class CountingDomain:
+    """
+     Wrapper of a TraCI domain (eg. traci.vehicle) counting the calls of its functions.
+    """
+
+    def __init__(self, domain, profiler):
+        self._domain = domain
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        function = getattr(self._domain, name)
+        if not callable(function):
+            return function
+        return counted(function, self._profiler)
+
+
+class CountingConnection:
+    """
+     Wrapper of a TraCI connection (or the traci module itself) counting the TraCI calls. The calls of every domain in
+     TRACI_DOMAINS and of the functions of the connection itself (eg. simulationStep) are counted.
+    """
+
+    def __init__(self, conn, profiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._conn, name)
+        if name in TRACI_DOMAINS:
+            attribute = CountingDomain(attribute, self._profiler)
+        elif callable(attribute):
+            attribute = counted(attribute, self._profiler)
+        else:
+            return attribute
+        # Wrapped once per connection
+        setattr(self, name, attribute)
+        return attribute
+
+
+class StepProfiler:
+    """
+     Records the wall time of every simulation step split by phase, the TraCI calls, the number of active vehicles and
+     the memory of the tracking containers of the start-stop state.
+     :param memory_interval: The tracking memory is measured in every memory_interval-th step.
+    """
+
+    def __init__(self, memory_interval=100):
+        self.memory_interval = memory_interval
+        self.traci_calls = 0
+        self.records = []
+        self._step_start = 0.0
+        self._last_mark = 0.0
+        self._phase_times = {}
+        self._step_calls = 0
+        self._tracking_bytes = 0
+
+    def wrap(self, conn):
+        """
+         Returns the connection wrapped so that its TraCI calls are counted.
+        """
+        return CountingConnection(conn, self)
+
+    def start_step(self):
+        self._step_start = self._last_mark = time.perf_counter()
+        self._phase_times = {}
+        self._step_calls = self.traci_calls
+
+    def mark(self, phase):
+        """
+         Ends the given phase of the current step.
+        """
+        now = time.perf_counter()
+        self._phase_times[phase] = self._phase_times.get(phase, 0.0) + now - self._last_mark
+        self._last_mark = now
+
+    def end_step(self, step, vehicle_count, containers=()):
+        """
+         Ends the current step, the time since the last mark is counted as bookkeeping. The memory of the tracking
+         containers is measured after the end of the step, so it is not part of the step time.
+         :param step: The index of the step.
+         :param vehicle_count: The number of active vehicles in the step.
+         :param containers: The tracking containers (dictionaries, sets, or objects with an nbytes method) whose
+          memory is measured.
+        """
+        self.mark('bookkeeping')
+        if step % self.memory_interval == 0:
+            self._tracking_bytes = sum(container.nbytes() if hasattr(container, 'nbytes') else
+                                       sys.getsizeof(container) for container in containers)
+        record = {'step': step, 'wall_time': self._last_mark - self._step_start}
+        for phase in PHASES:
+            record[phase] = self._phase_times.get(phase, 0.0)
+        record['traci_calls'] = self.traci_calls - self._step_calls
+        record['vehicles'] = vehicle_count
+        record['tracking_bytes'] = self._tracking_bytes
+        self.records.append(record)
+
+    def summary(self):
+        """
+         Returns the summary of the recorded steps as a dictionary.
+        """
+        steps = len(self.records)
+        wall_time = sum(record['wall_time'] for record in self.records)
+        phases = {phase: sum(record[phase] for record in self.records) for phase in PHASES}
+        return {'steps': steps,
+                'wall_time': wall_time,
+                'mean_step_time': wall_time / steps if steps else 0.0,
+                'phase_times': phases,
+                'phase_shares': {phase: value / wall_time if wall_time else 0.0 for phase, value in phases.items()},
+                'traci_calls': self.traci_calls,
+                'traci_calls_per_step': self.traci_calls / steps if steps else 0.0,
+                'peak_vehicles': max((record['vehicles'] for record in self.records), default=0),
+                'tracking_bytes': self._tracking_bytes}
+
+    def print_summary(self):
+        summary = self.summary()
+        print("------------------------------")
+        print("Simulation loop profile:")
+        print(f"Steps: {summary['steps']}, wall time: {summary['wall_time']:.3f} s, "
+              f"mean step time: {summary['mean_step_time'] * 1e3:.3f} ms")
+        for phase in PHASES:
+            print(f"{phase}: {summary['phase_times'][phase]:.3f} s ({summary['phase_shares'][phase]:.1%})")
+        print(f"TraCI calls: {summary['traci_calls']} ({summary['traci_calls_per_step']:.1f} per step)")
+        print(f"Peak vehicles: {summary['peak_vehicles']}, "
+              f"tracking memory: {summary['tracking_bytes'] / 2 ** 20:.2f} MiB")
+
+    def write_trace(self, csv_file):
+        """
+         Writes the per-step records into a CSV file.
+        """
+        with open(csv_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['step', 'wall_time', *PHASES, 'traci_calls', 'vehicles',
+                                                   'tracking_bytes'])
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def write_summary(self, json_file):
+        """
+         Writes the summary into a JSON file.
+        """
+        with open(json_file, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
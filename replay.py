@@ -0,0 +1,65 @@
+import os
+import xml.etree.ElementTree as ET
+import startstop as Stp
+
+
+def replay_start_stop(steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec, idle_values=None,
+                      original_emissions_file="results/emissions_default.xml",
+                      start_stop_emissions_file="results/emissions_start_stop.xml",
+                      default_totals=None, start_stop_totals=None, engine_off_threshold=Stp.ENGINE_OFF_THRESHOLD,
+                      assignment_seed=None, idle_rates=None):
+    """
+     A function to compute the start-stop emissions from an existing SUMO emission dump without running SUMO.
+     The emission dump contains the speed, the vehicle type and the emissions of every vehicle in every step, which is
+     everything the start-stop state machine needs. The dump is streamed through the same StartStopController as the
+     TraCI simulation and the start-stop values are patched into the copy on the fly.
+     :param steptime: The step length of the simulation that created the dump in seconds.
+     :param start_stop_ratio: Ratio of the start-stop vehicles given in %.
+     :param ratio_based_simulation: If True, the start-stop vehicles are assigned by the ratio.
+     :param idle_time_in_sec: The amount of time the idle values are considered after an engine restart.
+     :param idle_values: Dictionary of the idle emission values, or None to use the defaults.
+     :param original_emissions_file: The SUMO emission dump to replay.
+     :param start_stop_emissions_file: The path of the start-stop emission dump.
+     :param default_totals: Optional EmissionTotals summing up the original emissions in the same pass.
+     :param start_stop_totals: Optional EmissionTotals summing up the start-stop emissions in the same pass.
+     :param engine_off_threshold: Stop duration in seconds after which the engine is switched off.
+     :param assignment_seed: Optional seed of the hash-based start-stop assignment, a replay with the seed of the
+      simulation assigns the same vehicles.
+     :param idle_rates: Optional IdleRateTable of the idle rates per emission class, the class of the vehicles is read
+      from the eclass attribute of the dump.
+     :return: True on success and False on failure.
+    """
+    if not os.path.exists(original_emissions_file):
+        print(f"Missing original emissions file! ({original_emissions_file})")
+        return False
+
+    controller = Stp.StartStopController(steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+                                         Stp.complete_idle_values(idle_values), engine_off_threshold, assignment_seed,
+                                         idle_rates)
+
+    def patch_timestep(timestep):
+        time = float(timestep.attrib['time'])
+        for vehicle in timestep.iter('vehicle'):
+            attrib = vehicle.attrib
+            vehicle_id = attrib['id']
+            emissions = Stp.read_emissions(vehicle)
+            if default_totals is not None:
+                default_totals.add(vehicle_id, time, emissions)
+
+            if vehicle_id not in controller.assigned_vehicles:
+                controller.assign(vehicle_id, attrib.get('type'), attrib.get('eclass'))
+            start_stop_values = controller.update(vehicle_id, float(attrib['speed']), emissions)
+            if start_stop_values is not None:
+                for type, value in zip(Stp.EMISSION_TYPES, start_stop_values):
+                    attrib[type] = str(value)
+                emissions = start_stop_values
+
+            if start_stop_totals is not None:
+                start_stop_totals.add(vehicle_id, time, emissions)
+
+    try:
+        Stp.transform_emission_dump(original_emissions_file, start_stop_emissions_file, patch_timestep)
+    except (OSError, ET.ParseError) as error:
+        print(f"Failed to replay the emission dump: {error}")
+        return False
+    return True
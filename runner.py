@@ -0,0 +1,133 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import os
+from multiprocessing import Pool
+import startstop as Stp
+
+"""
+ Headless batch runner of start-stop simulations.
+ Every combination of SUMO configuration, seed and start-stop ratio is simulated by its own headless SUMO instance in
+ a process pool. Each run writes its emission dumps into its own folder and the cumulative emissions of all runs are
+ merged into one summary CSV.
+ Usage: python runner.py examples/cfg_10_free.sumocfg --seeds 1 2 3 --ratios 20 50 80 --processes 8
+"""
+
+
+# Columns of the summary, a failed scenario has one row with its error and no emissions
+SUMMARY_FIELDS = ['scenario', 'sumocfg', 'seed', 'start_stop_ratio', 'status', 'error', 'emission_type',
+                  'default_total', 'start_stop_total', 'difference', 'output_dir']
+
+
+def scenario_name(sumocfg, seed, start_stop_ratio):
+    """
+     Returns the name of a scenario, used for its output folder and TraCI label. A short hash of the absolute path of
+     the configuration tells apart configurations with the same file name in different folders.
+    """
+    config_name = os.path.splitext(os.path.basename(sumocfg))[0]
+    path_hash = hashlib.sha1(os.path.abspath(sumocfg).encode('utf-8')).hexdigest()[:8]
+    return f"{config_name}_{path_hash}_seed{seed}_ratio{start_stop_ratio}"
+
+
+def run_scenario(scenario):
+    """
+     A function to simulate one scenario in a worker process. Errors of the scenario (eg. SUMO failing to start or
+     a lost TraCI connection) are caught, so the other scenarios of the batch still run.
+     :param scenario: Dictionary of the run_simulation parameters of the scenario.
+     :return: The rows of the scenario in the summary, a single failed row on errors.
+    """
+    sumocfg = scenario['sumocfg']
+    name = scenario_name(sumocfg, scenario['seed'], scenario['start_stop_ratio'])
+    output_dir = os.path.join(scenario['output_root'], name)
+    row = {'scenario': name, 'sumocfg': sumocfg, 'seed': scenario['seed'],
+           'start_stop_ratio': scenario['start_stop_ratio'], 'output_dir': output_dir}
+    try:
+        steptime = float(Stp.extract_step_length(sumocfg))
+        duration = float(Stp.extract_duration(sumocfg))
+        totals = Stp.run_simulation(sumocfg, duration, steptime, scenario['start_stop_ratio'],
+                                    scenario['ratio_based_simulation'], scenario['idle_time_in_sec'],
+                                    scenario['idle_values'], engine_off_threshold=scenario['engine_off_threshold'],
+                                    output_dir=output_dir, gui=False, seed=scenario['seed'], label=name,
+                                    plot=False, assignment_seed=scenario['assignment_seed'])
+        error = None if totals is not None else "The emission data processing failed."
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    if error is not None:
+        print(f"Scenario {name} failed! ({error})")
+        return [dict(row, status='failed', error=error)]
+
+    default_totals = totals[0].pollutant_totals()
+    start_stop_totals = totals[1].pollutant_totals()
+    return [dict(row, status='ok', error='', emission_type=emission_type, default_total=default_totals[emission_type],
+                 start_stop_total=start_stop_totals[emission_type],
+                 difference=start_stop_totals[emission_type] - default_totals[emission_type])
+            for emission_type in Stp.EMISSION_TYPES]
+
+
+def run_batch(sumocfgs, seeds, start_stop_ratios, output_root="results/batch", processes=None,
+              ratio_based_simulation=True, idle_time_in_sec=7, idle_values=None,
+              engine_off_threshold=Stp.ENGINE_OFF_THRESHOLD, assignment_seed=None):
+    """
+     A function to simulate every combination of the given SUMO configurations, seeds and start-stop ratios in
+     parallel headless SUMO instances.
+     :param sumocfgs: List of SUMO configuration files.
+     :param seeds: List of random seeds for SUMO.
+     :param start_stop_ratios: List of start-stop ratios in %.
+     :param output_root: The folder of the run folders and the summary.
+     :param processes: Number of worker processes, None uses every core.
+     :param assignment_seed: Optional seed of the hash-based start-stop assignment, shared by every run so the same
+      vehicles are start-stop vehicles in every scenario.
+     :return: The rows of the summary, also written to summary.csv in the output_root. Failed scenarios have a row
+      with the status failed and their error.
+     :raises ValueError: If a scenario is given twice, its runs would write into the same folder.
+    """
+    scenarios = [{'sumocfg': sumocfg, 'seed': seed, 'start_stop_ratio': start_stop_ratio,
+                  'output_root': output_root, 'ratio_based_simulation': ratio_based_simulation,
+                  'idle_time_in_sec': idle_time_in_sec, 'idle_values': idle_values,
+                  'engine_off_threshold': engine_off_threshold, 'assignment_seed': assignment_seed}
+                 for sumocfg, seed, start_stop_ratio in itertools.product(sumocfgs, seeds, start_stop_ratios)]
+    names = [scenario_name(scenario['sumocfg'], scenario['seed'], scenario['start_stop_ratio'])
+             for scenario in scenarios]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate scenarios in the batch: {', '.join(duplicates)}")
+
+    if not os.path.exists(output_root):
+        os.makedirs(output_root)
+
+    with Pool(processes) as pool:
+        rows = [row for scenario_rows in pool.imap(run_scenario, scenarios) for row in scenario_rows]
+
+    if rows:
+        with open(os.path.join(output_root, "summary.csv"), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        failed = sum(1 for row in rows if row['status'] == 'failed')
+        print(f"Summary of {len(scenarios)} runs ({failed} failed) written in "
+              f"{os.path.join(output_root, 'summary.csv')}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs start-stop simulations in parallel headless SUMO instances.")
+    parser.add_argument("sumocfgs", nargs="+", help="SUMO configuration files.")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[42], help="Random seeds for SUMO.")
+    parser.add_argument("--ratios", type=int, nargs="+", default=[80], help="Start-stop ratios in %%.")
+    parser.add_argument("--idle-time", type=float, default=7, help="Idle time after an engine restart in seconds.")
+    parser.add_argument("--engine-off-threshold", type=float, default=Stp.ENGINE_OFF_THRESHOLD,
+                        help="Stop duration in seconds after which the engine is switched off.")
+    parser.add_argument("--assignment-seed", type=int,
+                        help="Seed of the hash-based start-stop assignment (default: assignment by arrival order).")
+    parser.add_argument("--output", default="results/batch", help="Folder of the run folders and the summary.")
+    parser.add_argument("--processes", type=int, help="Number of worker processes (default: every core).")
+    args = parser.parse_args()
+
+    run_batch(args.sumocfgs, args.seeds, args.ratios, args.output, args.processes,
+              idle_time_in_sec=args.idle_time, engine_off_threshold=args.engine_off_threshold,
+              assignment_seed=args.assignment_seed)
+
+
+if __name__ == "__main__":
+    main()
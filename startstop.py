@@ -1,201 +1,619 @@
+import csv
+import hashlib
+import json
 import os
 import xml.etree.ElementTree as ET
 import traci
+import traci.constants as tc
+import numpy as np
 import matplotlib.pyplot as plt
+from emission_arrays import EmissionArrayWriter, array_path, load_emission_arrays
+from emission_store import StopEpisodes
+from profiling import StepProfiler
+from xml_stream import XmlStreamWriter, iter_timesteps
+
+EMISSION_TYPES = ['CO2', 'CO', 'HC', 'NOx', 'PMx']
+
+# Idle emission values measured from SUMO's HBEFA4/PC_petrol_Euro-4 model
+DEFAULT_IDLE_VALUES = {'CO2': 1.4,
+                       'CO': 6.556e-11,
+                       'HC': 4.569000000000001e-13,
+                       'NOx': 0.611700000001176,
+                       'PMx': 7.192094822220001e-05}
+
+# File names of the emission dumps in the results folder
+DEFAULT_EMISSIONS_FILE = "emissions_default.xml"
+START_STOP_EMISSIONS_FILE = "emissions_start_stop.xml"
+VEHICLE_SUMMARY_FILE = "vehicle_stops.csv"
+EMISSION_CUBE_FILE = "emission_cube.npz"
+ENGINE_OFF_HISTOGRAM_FILE = "engine_off_histogram.csv"
+
+# Stop duration in seconds after which the start-stop system switches off the engine
+ENGINE_OFF_THRESHOLD = 2
+# Speed in m/s below which a vehicle counts as stopped. SUMO writes the speeds of the emission output with two
+# decimals (--precision 2), so a vehicle creeping below this speed is stopped in the dump; the simulation uses the same
+# limit to find the same stops as the replay of its dump
+STOP_SPEED = 0.005
+
+# Vehicle type of the start-stop vehicles, and the suffix of the start-stop copies of vehicle types written by the
+# precomputed assignment (see assignment.py)
+START_STOP_TYPE = 'start-stop-vehicle'
+START_STOP_TYPE_SUFFIX = '.start-stop'
+
+# TraCI variables of the emission types, in EMISSION_TYPES order
+EMISSION_VARIABLES = [tc.VAR_CO2EMISSION, tc.VAR_COEMISSION, tc.VAR_HCEMISSION, tc.VAR_NOXEMISSION,
+                      tc.VAR_PMXEMISSION]
+
+# Vehicle variables collected in every step when the subscription-based collection is used
+SUBSCRIBED_VARIABLES = [tc.VAR_SPEED] + EMISSION_VARIABLES + [tc.VAR_TYPE]
 
 
 def run_simulation(sumocfg, duration, steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
-                   idle_values=None):
+                   idle_values=None, use_subscriptions=True, engine_off_threshold=ENGINE_OFF_THRESHOLD,
+                   output_dir="results", gui=True, seed=None, label="default", plot=True, profile=False,
+                   array_format=None, live_totals=None, write_dumps=True, cube=None, checkpointer=None,
+                   assignment_seed=None, idle_rates=None):
     """
      A function to start the SUMO simulation with the given SUMO configuration using the extracted SUMO settings.
      SUMO is set to dump the emission data at the end of the simulation. The emission dump is then copied and
      overwritten by the start-stop emission data. This way, both the non start-stop data and start-stop data are saved.
+     With use_subscriptions, the per-vehicle values are collected with TraCI subscriptions instead of polling them
+     one getter call at a time.
+     For batch runs, SUMO can be started without GUI (gui=False) with a given random seed, the results can be written
+     to a separate output_dir, and the TraCI connection gets its own label.
+     With profile, the simulation loop is instrumented and its per-step trace and summary are written to the
+     output_dir.
+     With array_format ('raw', 'npz' or 'parquet'), both emission dumps are also written as columnar binary files.
+     With live_totals (LiveEmissionTotals), the cumulative emissions are summed up in the simulation loop and can be
+     followed during the run. Without write_dumps, no emission dumps are written and the live totals are reported.
+     With cube (EmissionCube), both cases are also aggregated per edge or lane and time bin, and the cube is written to
+     the output_dir. Without write_dumps, the cube is filled by the live totals created for the run.
+     With checkpointer (checkpoint.Checkpointer), the SUMO and the start-stop state are saved periodically. A
+     checkpointer created with resume continues the run from its last checkpoint: SUMO loads the saved state and the
+     emission output of every restart is merged into one dump at the end. The live totals and their cube are part of
+     the checkpoint, so they cover the whole run.
+     With assignment_seed, the start-stop vehicles are assigned by a seeded hash of their id (see
+     StartStopController), so every run with the same seed assigns the same vehicles.
+     With idle_rates (idle_rates.IdleRateTable), the restart penalty of every start-stop vehicle is computed from the
+     idle rates of its emission class instead of the idle_values.
+     :return: The EmissionTotals of the non start-stop and the start-stop case, or None on errors.
     """
     # Create results folder if it does not exist
-    if not os.path.exists("results"):
-        os.makedirs("results")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
         print("Results folder was created.")
 
-    default_idle_values = {'CO2': 1.4,
-                           'CO': 6.556e-11,
-                           'HC': 4.569000000000001e-13,
-                           'NOx': 0.611700000001176,
-                           'PMx': 7.192094822220001e-05}
+    idle_values = complete_idle_values(idle_values)
 
-    if idle_values is None:
-        idle_values = {'CO2': 1.4,
-                       'CO': 6.556e-11,
-                       'HC': 4.569000000000001e-13,
-                       'NOx': 0.611700000001176,
-                       'PMx': 7.192094822220001e-05}
+    # Set the SUMO command to start SUMO and dump emissions to the results folder
+    if gui:
+        sumocmd = ["sumo-gui", "-c", sumocfg, "--start"]
     else:
-        emission_types = ['CO2', 'CO', 'HC', 'NOx', 'PMx']
+        sumocmd = ["sumo", "-c", sumocfg]
+    emissions_file = os.path.join(output_dir, DEFAULT_EMISSIONS_FILE)
+    if write_dumps:
+        sumocmd += ["--emission-output",
+                    emissions_file if checkpointer is None else checkpointer.emission_output(emissions_file)]
+    elif live_totals is None:
+        live_totals = LiveEmissionTotals(cube=cube)
+    if seed is not None:
+        sumocmd += ["--seed", str(seed)]
+    if checkpointer is not None and checkpointer.state_file is not None:
+        sumocmd += ["--load-state", checkpointer.state_file]
+    profiler = StepProfiler() if profile else None
+    vehicle_sink = VehicleSummaryWriter(os.path.join(output_dir, VEHICLE_SUMMARY_FILE),
+                                        None if checkpointer is None else checkpointer.summary_offset)
+    conn = None
+    try:
+        # Start SUMO with the command, TraCI picks a free port for every connection
+        traci.start(sumocmd, label=label)
+        conn = traci.getConnection(label)
+        stop_episodes = simulate_start_stop(conn, duration, steptime, start_stop_ratio, ratio_based_simulation,
+                                            idle_time_in_sec, idle_values, use_subscriptions, engine_off_threshold,
+                                            profiler, vehicle_sink, live_totals, checkpointer, assignment_seed,
+                                            idle_rates)
+    finally:
+        vehicle_sink.close()
+        # Close TraCI also after errors, so the SUMO process does not outlive the run (eg. in a batch worker)
+        if conn is not None:
+            conn.close()
 
-        for type in emission_types:
-            if type not in idle_values:
-                idle_values[type] = default_idle_values[type]
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.write_trace(os.path.join(output_dir, "profile_trace.csv"))
+        profiler.write_summary(os.path.join(output_dir, "profile_summary.json"))
+    if checkpointer is not None:
+        checkpointer.print_summary()
+        if write_dumps:
+            checkpointer.merge_emission_output(emissions_file)
 
-        print(idle_values)
+    print("Simulation ended.")
+    print_episode_summary(stop_episodes, output_dir)
 
-    # Set the SUMO command to start SUMO with GUI and dump emissions to the results folder
-    sumocmd = ["sumo-gui", "-c", sumocfg, "--start", "--emission-output", "results/emissions_default.xml"]
-    # Start SUMO with the command
-    traci.start(sumocmd)
+    if not write_dumps:
+        default_totals, start_stop_totals = live_totals.emission_totals()
+        calculate_cumulative_emissions(default_totals, start_stop_totals, output_dir, plot)
+        save_emission_cube(cube, output_dir)
+        print("Program ended successfully.")
+        return default_totals, start_stop_totals
 
-    # Actual simulation time
-    simulation_time = 0.00
+    print("Starting emission data processing...")
 
-    # Idle values
-    idle_co2 = idle_values['CO2']
-    idle_co = idle_values['CO']
-    idle_hc = idle_values['HC']
-    idle_nox = idle_values['NOx']
-    idle_pmx = idle_values['PMx']
+    # Handle emission results, the cumulative emissions are summed up while the start-stop dump is written
+    default_totals = EmissionTotals()
+    start_stop_totals = EmissionTotals()
+    if create_start_stop_emissions(stop_episodes, default_totals, start_stop_totals, output_dir,
+                                   array_format, cube):
+        print(f"Start-stop emission data successfully written in "
+              f"{os.path.join(output_dir, START_STOP_EMISSIONS_FILE)}")
+    else:
+        print("Error in emission results handling!")
+        return None
 
-    # Idle emission for 7 seconds
-    idle_co2_7s = idle_co2 * idle_time_in_sec
-    idle_co_7s = idle_co * idle_time_in_sec
-    idle_hc_7s = idle_hc * idle_time_in_sec
-    idle_nox_7s = idle_nox * idle_time_in_sec
-    idle_pmx_7s = idle_pmx * idle_time_in_sec
+    print("Calculating cumulative emissions...")
+    calculate_cumulative_emissions(default_totals, start_stop_totals, output_dir, plot)
+    save_emission_cube(cube, output_dir)
 
-    # Data storages
-    start_stop_data = {}
-    regular_data = {}
-    start_stop_vehicles = set()
-    assigned_vehicles = set()
-    total_vehicles_processed = 0
-    vehicle_emission_data_per_step = {}
+    print("Program ended successfully.")
+    return default_totals, start_stop_totals
+
+
+def complete_idle_values(idle_values=None):
+    """
+     A function to fill the missing emission types of the user given idle values with the default idle values.
+     :param idle_values: Dictionary of the idle emission values, or None to use the defaults.
+     :return: Dictionary of the idle emission values containing every emission type.
+    """
+    if idle_values is None:
+        return dict(DEFAULT_IDLE_VALUES)
 
-    stop_times = {}  # Dictionary to store stop times
+    for type in EMISSION_TYPES:
+        if type not in idle_values:
+            idle_values[type] = DEFAULT_IDLE_VALUES[type]
+
+    print(idle_values)
+    return idle_values
+
+
+def read_polled_values(conn, departed, read_road=False):
+    """
+     A function to read the per-vehicle values of the current step with one TraCI getter call per value.
+     The vehicle type is only requested for the vehicles that departed in the current step.
+     :param conn: The TraCI connection (or the traci module itself).
+     :param departed: List of the vehicle ids that departed in the current step.
+     :param read_road: If True, the edge of the vehicles is also read.
+     :return: Dictionary of the vehicle values keyed by vehicle id, in the same format as the subscription results.
+    """
+    vehicle_values = {}
+    for vehicle_id in conn.vehicle.getIDList():
+        values = {tc.VAR_SPEED: conn.vehicle.getSpeed(vehicle_id),
+                  tc.VAR_CO2EMISSION: conn.vehicle.getCO2Emission(vehicle_id),
+                  tc.VAR_COEMISSION: conn.vehicle.getCOEmission(vehicle_id),
+                  tc.VAR_HCEMISSION: conn.vehicle.getHCEmission(vehicle_id),
+                  tc.VAR_NOXEMISSION: conn.vehicle.getNOxEmission(vehicle_id),
+                  tc.VAR_PMXEMISSION: conn.vehicle.getPMxEmission(vehicle_id)}
+        if read_road:
+            values[tc.VAR_ROAD_ID] = conn.vehicle.getRoadID(vehicle_id)
+        vehicle_values[vehicle_id] = values
+    for vehicle_id in departed:
+        values = vehicle_values.get(vehicle_id)
+        if values is not None:
+            values[tc.VAR_TYPE] = conn.vehicle.getTypeID(vehicle_id)
+    return vehicle_values
 
-    start_stop_threshold = start_stop_ratio / 100.0
+
+def read_subscribed_values(conn, departed, variables=SUBSCRIBED_VARIABLES):
+    """
+     A function to read the per-vehicle values of the current step with a single TraCI call. The vehicles that
+     departed in the current step are subscribed first, SUMO drops the subscriptions of arrived vehicles by itself.
+     :param conn: The TraCI connection (or the traci module itself).
+     :param departed: List of the vehicle ids that departed in the current step.
+     :param variables: The subscribed vehicle variables.
+     :return: Dictionary of the vehicle values keyed by vehicle id.
+    """
+    for vehicle_id in departed:
+        conn.vehicle.subscribe(vehicle_id, variables)
+    return conn.vehicle.getAllSubscriptionResults()
+
+
+def simulate_start_stop(conn, duration, steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+                        idle_values, use_subscriptions=True, engine_off_threshold=ENGINE_OFF_THRESHOLD,
+                        profiler=None, vehicle_sink=None, live_totals=None, checkpointer=None, assignment_seed=None,
+                        idle_rates=None):
+    """
+     A function to step through the running simulation and collect the start-stop emission data.
+     :param conn: The TraCI connection (or the traci module itself) of the running simulation.
+     :param duration: The end time of the simulation in seconds.
+     :param steptime: The step length of the simulation in seconds.
+     :param start_stop_ratio: Ratio of the start-stop vehicles given in %.
+     :param ratio_based_simulation: If True, the start-stop vehicles are assigned by the ratio.
+     :param idle_time_in_sec: The amount of time the idle values are considered after an engine restart.
+     :param idle_values: Dictionary of the idle emission values containing every emission type.
+     :param use_subscriptions: If True, the vehicle values are read with subscriptions instead of polling.
+     :param engine_off_threshold: Stop duration in seconds after which the engine is switched off.
+     :param profiler: Optional StepProfiler recording the time and the TraCI calls of every step.
+     :param vehicle_sink: Optional VehicleSummaryWriter receiving the final state of every vehicle.
+     :param live_totals: Optional LiveEmissionTotals summing up the emissions in every step.
+     :param checkpointer: Optional Checkpointer saving the state periodically, the loop continues from its last
+      checkpoint if it was created with resume.
+     :param assignment_seed: Optional seed of the hash-based start-stop assignment.
+     :param idle_rates: Optional IdleRateTable of the idle rates per emission class.
+     :return: The stop episodes of the start-stop vehicles (StopEpisodes).
+    """
+    controller = StartStopController(steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec,
+                                     idle_values, engine_off_threshold, assignment_seed, idle_rates)
+    if profiler is not None:
+        conn = profiler.wrap(conn)
+    recorder = StartStopRecorder(controller, vehicle_sink, live_totals,
+                                 None if idle_rates is None else EmissionClassCache(conn), profiler)
+
+    first_step = 0
+    if checkpointer is not None:
+        first_step = checkpointer.restore(recorder)
+        if first_step and use_subscriptions:
+            # Subscriptions are not part of the SUMO state, the vehicles of the loaded state are subscribed again
+            variables = SUBSCRIBED_VARIABLES + [tc.VAR_ROAD_ID] if recorder.read_road else SUBSCRIBED_VARIABLES
+            for vehicle_id in conn.vehicle.getIDList():
+                conn.vehicle.subscribe(vehicle_id, variables)
 
     # Simulation steps
-    for i in range(int(duration / steptime)):
-        traci.simulationStep()
-        current_vehicle_ids = set(traci.vehicle.getIDList())
-        for vehicle_id in current_vehicle_ids:
-            if vehicle_id not in assigned_vehicles:
-                vehicle_type = traci.vehicle.getTypeID(vehicle_id)
-                total_vehicles_processed += 1
-                if ((len(start_stop_vehicles) / total_vehicles_processed) < start_stop_threshold and
-                        ratio_based_simulation):
-                    start_stop_vehicles.add(vehicle_id)
-                elif vehicle_type == 'start-stop-vehicle':
-                    start_stop_vehicles.add(vehicle_id)
-                    traci.vehicle.setColor(vehicle_id, (255, 0, 0, 255))
-                assigned_vehicles.add(vehicle_id)
-
-            # Read current values
-            current_speed = traci.vehicle.getSpeed(vehicle_id)
-            current_co2 = traci.vehicle.getCO2Emission(vehicle_id)
-            current_co = traci.vehicle.getCOEmission(vehicle_id)
-            current_hc = traci.vehicle.getHCEmission(vehicle_id)
-            current_nox = traci.vehicle.getNOxEmission(vehicle_id)
-            current_pmx = traci.vehicle.getPMxEmission(vehicle_id)
-
-            # Track stop times
-            if current_speed == 0:
-                stop_times[vehicle_id] = stop_times.get(vehicle_id, 0) + steptime
-
-            # Start-stop functionality
-            if vehicle_id in start_stop_vehicles:
-                if current_speed == 0:
-                    if vehicle_id not in start_stop_data:
-                        start_stop_data[vehicle_id] = {'time': simulation_time, 'speed': current_speed,
-                                                       'co2': current_co2, 'co': current_co, 'hc': current_hc,
-                                                       'nox': current_nox, 'pmx': current_pmx}
-                    else:
-                        start_stop_data[vehicle_id]['time'] += steptime
-
-                    # If the vehicle is not present in the emission data yet, it means it just stopped.
-                    # It must be added with idle emissions.
-                    if vehicle_id not in vehicle_emission_data_per_step:
-                        vehicle_emission_data_per_step[vehicle_id] = {}
-                        vehicle_emission_data_per_step[vehicle_id][simulation_time] = {'CO2': current_co2,
-                                                                                       'CO': current_co,
-                                                                                       'HC': current_hc,
-                                                                                       'NOx': current_nox,
-                                                                                       'PMx': current_pmx,
-                                                                                       }
-                    else:
-                        # The vehicle was already in the emission data,
-                        # meaning it is either still stopped or stopped again
-
-                        # We check if the vehicle is stopped for more than 2 seconds
-                        # If it is stopped for more than 2 seconds, the start-stop system stopped the engine
-                        # we have to assign zero emissions until engine start
-                        if start_stop_data[vehicle_id]['time'] > 2:
-                            # Assuming engine is stopped, zero emission
-                            vehicle_emission_data_per_step[vehicle_id][simulation_time] = {'CO2': 0.0,
-                                                                                           'CO': 0.0,
-                                                                                           'HC': 0.0,
-                                                                                           'NOx': 0.0,
-                                                                                           'PMx': 0.0
-                                                                                           }
-                        else:
-                            # Engine still running in idle, enough to read current emission data and store them
-                            vehicle_emission_data_per_step[vehicle_id][simulation_time] = {'CO2': current_co2,
-                                                                                           'CO': current_co,
-                                                                                           'HC': current_hc,
-                                                                                           'NOx': current_nox,
-                                                                                           'PMx': current_pmx,
-                                                                                           }
-
-                else:
-                    # Vehicle is moving
-                    if vehicle_id in start_stop_data:
-                        # Check if it was stationary for more than 2 seconds
-                        if start_stop_data[vehicle_id]['time'] >= 2:
-                            adjusted_co2 = current_co2 + idle_co2_7s
-                            start_stop_data[vehicle_id]['co2'] = adjusted_co2
-
-                        if vehicle_id not in vehicle_emission_data_per_step:
-                            if start_stop_data[vehicle_id]['time'] >= 2:
-                                vehicle_emission_data_per_step[vehicle_id] = {}
-                                vehicle_emission_data_per_step[vehicle_id][simulation_time] = {
-                                    'CO2': current_co2 + idle_co2_7s,
-                                    'CO': current_co + idle_co_7s,
-                                    'HC': current_hc + idle_hc_7s,
-                                    'NOx': current_nox + idle_nox_7s,
-                                    'PMx': current_pmx + idle_pmx_7s}
-                        else:
-                            if start_stop_data[vehicle_id]['time'] >= 2:
-                                vehicle_emission_data_per_step[vehicle_id][simulation_time] = {
-                                    'CO2': current_co2 + idle_co2_7s,
-                                    'CO': current_co + idle_co_7s,
-                                    'HC': current_hc + idle_hc_7s,
-                                    'NOx': current_nox + idle_nox_7s,
-                                    'PMx': current_pmx + idle_pmx_7s}
-                        start_stop_data[vehicle_id]['time'] = 0
-                        start_stop_data[vehicle_id]['speed'] = current_speed
-            else:
-                # Regular vehicle data collection
-                regular_data[vehicle_id] = {'time': simulation_time, 'speed': current_speed, 'co2': current_co2,
-                                            'co': current_co, 'hc': current_hc,
-                                            'nox': current_nox, 'pmx': current_pmx}
-
-            simulation_time = i * steptime
-
-    # Close TraCI
-    traci.close()
+    for i in range(first_step, int(duration / steptime)):
+        if profiler is not None:
+            profiler.start_step()
+        conn.simulationStep()
+        if profiler is not None:
+            profiler.mark('simulation_step')
 
-    print("Simulation ended.")
-    print("Starting emission data processing...")
+        departed, vehicle_values, arrived = read_step(conn, use_subscriptions, recorder.read_road)
+        if profiler is not None:
+            profiler.mark('collection')
 
-    # Handle emission results
-    if create_start_stop_emissions(vehicle_emission_data_per_step, stop_times):
-        print("Start-stop emission data successfully written in results/emissions_start_stop.xml")
+        # The recorder marks the start-stop and the bookkeeping phase
+        for vehicle_id in recorder.process_step(i, departed, vehicle_values, arrived):
+            conn.vehicle.setColor(vehicle_id, (255, 0, 0, 255))
+        if profiler is not None:
+            profiler.mark('highlight')
+        if checkpointer is not None and checkpointer.due(i):
+            checkpointer.save(conn, i, recorder)
+            if profiler is not None:
+                profiler.mark('checkpoint')
+
+        if profiler is not None:
+            profiler.end_step(i, len(vehicle_values), recorder.tracking_containers())
+
+    recorder.finish()
+    return recorder.episodes
+
+
+def read_step(conn, use_subscriptions=True, read_road=False):
+    """
+     A function to read everything the start-stop model needs from the step SUMO just executed.
+     :param conn: The TraCI connection (or the traci module itself).
+     :param use_subscriptions: If True, the vehicle values are read with subscriptions instead of polling.
+     :param read_road: If True, the edge of the vehicles is also read.
+     :return: The departed vehicle ids, the vehicle values keyed by vehicle id and the arrived vehicle ids.
+    """
+    departed = conn.simulation.getDepartedIDList()
+    if use_subscriptions:
+        variables = SUBSCRIBED_VARIABLES + [tc.VAR_ROAD_ID] if read_road else SUBSCRIBED_VARIABLES
+        vehicle_values = read_subscribed_values(conn, departed, variables)
     else:
-        print("Error in emission results handling!")
-        return
+        vehicle_values = read_polled_values(conn, departed, read_road)
+    arrived = conn.simulation.getArrivedIDList()
+    return departed, vehicle_values, arrived
 
-    print("Calculating cumulative emissions...")
-    calculate_cumulative_emissions()
 
-    print("Program ended successfully.")
-    return
+class StartStopRecorder:
+    """
+     Applies the StartStopController to the vehicle values of every step and records the results: the stop episodes
+     of the start-stop vehicles, the final state of the arrived vehicles and the optional live totals. It does not
+     talk to SUMO, so the same recorder serves the simulation loop, step listeners and asynchronous TraCI clients.
+     A stop is recorded as one episode when it ends (see StopEpisodes), the steps of the stop write nothing.
+     With emission_classes (eg. EmissionClassCache), the emission class of the departed vehicles is resolved from
+     their type for the per-class idle rates of the controller.
+     A step runs the controller first and records its results afterwards, so a profiler (StepProfiler) times the
+     state machine and the bookkeeping as separate phases.
+    """
+
+    def __init__(self, controller, vehicle_sink=None, live_totals=None, emission_classes=None, profiler=None):
+        self.controller = controller
+        self.emission_classes = emission_classes
+        self.profiler = profiler
+        self.episodes = StopEpisodes(controller.steptime)
+        self.vehicle_sink = vehicle_sink
+        self.last_step = -1
+        self.live_totals = live_totals
+        # The live totals are also broken down per edge, which needs the edge of the vehicles
+        self.read_road = live_totals is not None
+
+    def process_step(self, step, departed, vehicle_values, arrived):
+        """
+         Processes the values read from a simulation step.
+         :param step: The index of the step.
+         :param departed: The vehicle ids that departed in the step.
+         :param vehicle_values: The vehicle values of the step keyed by vehicle id (see read_step).
+         :param arrived: The vehicle ids that arrived in the step.
+         :return: The ids of the vehicles assigned by their start-stop type, to be highlighted in the GUI.
+        """
+        controller = self.controller
+        live_totals = self.live_totals
+        highlighted = []
+
+        # Assign the vehicles that entered the network in this step
+        departed_types = []
+        for vehicle_id in departed:
+            values = vehicle_values.get(vehicle_id)
+            if values is not None:
+                vehicle_type = values[tc.VAR_TYPE]
+                emission_class = None if self.emission_classes is None else self.emission_classes(vehicle_type)
+                if controller.assign(vehicle_id, vehicle_type, emission_class) and is_start_stop_type(vehicle_type):
+                    highlighted.append(vehicle_id)
+                departed_types.append((vehicle_id, vehicle_type))
+
+        stop_steps = controller.stop_steps
+        ended_stops = []
+        updates = []
+        for vehicle_id, values in vehicle_values.items():
+            emissions = [values[variable] for variable in EMISSION_VARIABLES]
+            speed = values[tc.VAR_SPEED]
+            steps_stopped = stop_steps.get(vehicle_id) if speed >= STOP_SPEED else None
+            start_stop_values = controller.update(vehicle_id, speed, emissions)
+            if steps_stopped is not None:
+                # The stop ended in this step
+                ended_stops.append((vehicle_id, steps_stopped))
+            if live_totals is not None:
+                updates.append((vehicle_id, values, emissions, start_stop_values))
+        if self.profiler is not None:
+            self.profiler.mark('start_stop')
+
+        for vehicle_id, steps_stopped in ended_stops:
+            self.close_episode(vehicle_id, step, steps_stopped, True)
+        if live_totals is not None:
+            for vehicle_id, vehicle_type in departed_types:
+                live_totals.register(vehicle_id, vehicle_type)
+            for vehicle_id, values, emissions, start_stop_values in updates:
+                live_totals.add(vehicle_id, values[tc.VAR_ROAD_ID], emissions,
+                                emissions if start_stop_values is None else start_stop_values)
+
+        # The state of the vehicles that left the network is final, it is flushed and dropped
+        time = round(step * controller.steptime, 2)
+        for vehicle_id in arrived:
+            if vehicle_id in stop_steps:
+                self.close_episode(vehicle_id, step, stop_steps[vehicle_id], False)
+            record = controller.finalize(vehicle_id, time)
+            if self.vehicle_sink is not None:
+                self.vehicle_sink.write(record)
+            if live_totals is not None:
+                live_totals.drop(vehicle_id)
+        if live_totals is not None:
+            live_totals.end_step(step, time)
+        self.last_step = step
+        if self.profiler is not None:
+            self.profiler.mark('bookkeeping')
+        return highlighted
+
+    def close_episode(self, vehicle_id, end, steps_stopped, restarted):
+        """
+         Records the stop of a start-stop vehicle that ended before the given step. Stops without engine-off steps
+         and without a restart penalty do not change the emissions and are not recorded.
+         :param vehicle_id: The SUMO vehicle id.
+         :param end: The index of the step the vehicle moves again or is no longer simulated.
+         :param steps_stopped: The number of steps of the stop.
+         :param restarted: True if the vehicle moves again, False if it left the network or the simulation ended.
+        """
+        controller = self.controller
+        start = end - steps_stopped
+        engine_off = min(start + controller.engine_off_steps - 1, end)
+        penalty = restarted and steps_stopped * controller.steptime >= controller.engine_off_threshold
+        if penalty or engine_off < end:
+            self.episodes.add(vehicle_id, start, end, engine_off,
+                              controller.vehicle_penalty(vehicle_id) if penalty else controller.engine_off_values)
+
+    def finish(self):
+        """
+         Flushes the vehicles that are still in the network at the end of the simulation.
+        """
+        for vehicle_id, steps_stopped in list(self.controller.stop_steps.items()):
+            self.close_episode(vehicle_id, self.last_step + 1, steps_stopped, False)
+        for vehicle_id in list(self.controller.assigned_vehicles):
+            record = self.controller.finalize(vehicle_id)
+            if self.vehicle_sink is not None:
+                self.vehicle_sink.write(record)
+
+    def tracking_containers(self):
+        """
+         Returns the containers holding the tracked state, for the memory measurement of the profiler.
+        """
+        controller = self.controller
+        return (controller.assigned_vehicles, controller.start_stop_vehicles, controller.stop_steps,
+                controller.stop_times, controller.vehicle_rates, self.episodes)
+
+
+class StartStopController:
+    """
+     The start-stop state machine. It assigns the vehicles to the start-stop group, tracks the stops of the vehicles
+     and tells which emission values change when the start-stop system switches off and restarts the engine.
+     It only depends on the speed and the emission values of the vehicles, so it is shared by the TraCI simulation
+     and the offline replay of an emission dump.
+     Without an assignment_seed, the ratio is kept by assigning a new vehicle whenever the share of the start-stop
+     vehicles so far is below it, which depends on the order the vehicles are seen in. With an assignment_seed, every
+     vehicle id is hashed to a stable share (see assignment_share), so the assignment is the same in every run, worker
+     and replay with the same seed.
+     With idle_rates (idle_rates.IdleRateTable), the emission class of a start-stop vehicle is turned into its row of
+     the table when it is assigned, and its restarts add the idle rates of that row.
+    """
+
+    def __init__(self, steptime, start_stop_ratio, ratio_based_simulation, idle_time_in_sec, idle_values,
+                 engine_off_threshold=ENGINE_OFF_THRESHOLD, assignment_seed=None, idle_rates=None):
+        self.steptime = steptime
+        self.engine_off_threshold = engine_off_threshold
+        self.ratio_based_simulation = ratio_based_simulation
+        self.start_stop_threshold = start_stop_ratio / 100.0
+        self.assignment_seed = assignment_seed
+        # Idle emission for the restart of the engine
+        self.restart_penalty = [idle_values[type] * idle_time_in_sec for type in EMISSION_TYPES]
+        self.engine_off_values = [0.0] * len(EMISSION_TYPES)
+        # Number of stop steps after which the engine is off
+        self.engine_off_steps = 1
+        while self.engine_off_steps * steptime <= engine_off_threshold:
+            self.engine_off_steps += 1
+        # Idle emission for the restart of the engine per row of the idle rate table
+        self.idle_rates = idle_rates
+        self.restart_penalties = None if idle_rates is None else (idle_rates.rates * idle_time_in_sec).tolist()
+
+        # Data storages
+        self.stop_steps = {}  # Number of steps of the current stop of the start-stop vehicles
+        self.start_stop_vehicles = set()
+        self.assigned_vehicles = set()
+        self.total_vehicles_processed = 0
+        self.stop_times = {}  # Dictionary to store stop times
+        self.vehicle_rates = {}  # Row of the idle rate table of the start-stop vehicles
+
+    def assign(self, vehicle_id, vehicle_type, emission_class=None):
+        """
+         Assigns a newly seen vehicle to the start-stop or the regular group.
+         The emission_class is only used with the per-class idle rates.
+         :return: True if the vehicle is a start-stop vehicle.
+        """
+        self.total_vehicles_processed += 1
+        self.assigned_vehicles.add(vehicle_id)
+        if self.assignment_seed is not None:
+            by_ratio = assignment_share(vehicle_id, self.assignment_seed) < self.start_stop_threshold
+        else:
+            by_ratio = (len(self.start_stop_vehicles) / self.total_vehicles_processed) < self.start_stop_threshold
+        if (by_ratio and self.ratio_based_simulation) or is_start_stop_type(vehicle_type):
+            self.start_stop_vehicles.add(vehicle_id)
+            if self.idle_rates is not None:
+                self.vehicle_rates[vehicle_id] = self.idle_rates.row(emission_class)
+            return True
+        return False
+
+    def update(self, vehicle_id, speed, emissions):
+        """
+         Updates the state of the vehicle with its values in the current step.
+         :param vehicle_id: The SUMO vehicle id.
+         :param speed: The current speed of the vehicle, the vehicle is stopped below STOP_SPEED.
+         :param emissions: The current emission values of the vehicle in EMISSION_TYPES order.
+         :return: The start-stop emission values of the vehicle in the current step, or None if they are the same as
+          the current emission values.
+        """
+        steptime = self.steptime
+
+        # Track stop times
+        if speed < STOP_SPEED:
+            self.stop_times[vehicle_id] = self.stop_times.get(vehicle_id, 0) + steptime
+
+        if vehicle_id not in self.start_stop_vehicles:
+            return None
+
+        if speed < STOP_SPEED:
+            stop_steps = self.stop_steps.get(vehicle_id, 0) + 1
+            self.stop_steps[vehicle_id] = stop_steps
+
+            # We check if the vehicle is stopped for more than the engine-off threshold (2 seconds by default)
+            # If it is stopped for longer, the start-stop system stopped the engine
+            # we have to assign zero emissions until engine start.
+            # Until then the engine is idling and the emission data of SUMO is kept.
+            if stop_steps * steptime > self.engine_off_threshold:
+                return self.engine_off_values
+            return None
+
+        # Vehicle is moving
+        stop_steps = self.stop_steps.pop(vehicle_id, None)
+        # Check if it was stationary for at least the engine-off threshold, the restart adds the idle emissions
+        if stop_steps is not None and stop_steps * steptime >= self.engine_off_threshold:
+            return [value + penalty for value, penalty in zip(emissions, self.vehicle_penalty(vehicle_id))]
+        return None
+
+    def vehicle_penalty(self, vehicle_id):
+        """
+         Returns the restart penalty of a start-stop vehicle in EMISSION_TYPES order.
+        """
+        if self.idle_rates is None:
+            return self.restart_penalty
+        return self.restart_penalties[self.vehicle_rates.get(vehicle_id, 0)]
+
+    def finalize(self, vehicle_id, arrival_time=None):
+        """
+         Drops the state of a vehicle that left the network.
+         :param vehicle_id: The SUMO vehicle id.
+         :param arrival_time: The time the vehicle left the network, None if it was still running.
+         :return: The final state of the vehicle as a dictionary.
+        """
+        start_stop = vehicle_id in self.start_stop_vehicles
+        self.start_stop_vehicles.discard(vehicle_id)
+        self.assigned_vehicles.discard(vehicle_id)
+        self.stop_steps.pop(vehicle_id, None)
+        self.vehicle_rates.pop(vehicle_id, None)
+        return {'vehicle_id': vehicle_id, 'start_stop': start_stop,
+                'stop_time': self.stop_times.pop(vehicle_id, 0), 'arrival_time': arrival_time}
+
+
+class EmissionClassCache:
+    """
+     Emission classes of the vehicle types, requested from SUMO once per vehicle type. The type of a vehicle is read
+     when it departs anyway, so its emission class costs no TraCI call per vehicle or step.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.classes = {}
+
+    def __call__(self, vehicle_type):
+        emission_class = self.classes.get(vehicle_type)
+        if emission_class is None:
+            emission_class = self.classes[vehicle_type] = self.conn.vehicletype.getEmissionClass(vehicle_type)
+        return emission_class
+
+
+def assignment_share(vehicle_id, seed):
+    """
+     Returns a stable pseudo-random number in [0, 1) for the vehicle id and seed. Unlike hash(), it does not change
+     between Python processes. A vehicle is assigned to the start-stop group if its share is below the ratio.
+    """
+    digest = hashlib.blake2b(vehicle_id.encode(), digest_size=8, key=str(seed).encode()).digest()
+    return int.from_bytes(digest, 'little') / 2 ** 64
+
+
+def is_start_stop_type(vehicle_type):
+    """
+     Returns True for the start-stop vehicle type and the start-stop copies of vehicle types.
+    """
+    return vehicle_type == START_STOP_TYPE or (vehicle_type or '').endswith(START_STOP_TYPE_SUFFIX)
+
+
+class VehicleSummaryWriter:
+    """
+     Writes the final state of the vehicles (start-stop group, total stop time and arrival time) into a CSV file as
+     they leave the network, so it does not have to be kept in memory.
+     With resume_offset, the rows of an earlier run are kept up to the given file offset and the new rows are
+     appended.
+    """
+
+    def __init__(self, csv_file, resume_offset=None):
+        fieldnames = ['vehicle_id', 'start_stop', 'stop_time', 'arrival_time']
+        if resume_offset is None:
+            self.file = open(csv_file, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.writer.writeheader()
+        else:
+            self.file = open(csv_file, 'r+', newline='')
+            self.file.truncate(resume_offset)
+            self.file.seek(resume_offset)
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def offset(self):
+        """
+         Flushes the written rows and returns the current size of the file.
+        """
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
 
 
 def extract_step_length(sumocfg):
@@ -236,154 +654,447 @@ def extract_duration(sumocfg):
     return duration_value
 
 
-def create_start_stop_emissions(start_stop_data, stop_times):
+def print_episode_summary(episodes, output_dir="results", bin_size=5.0):
+    """
+     A function to print the statistics of the stop episodes and to write the histogram of the engine-off durations
+     into the results folder.
+     :param episodes: The stop episodes of the start-stop vehicles (StopEpisodes).
+     :param bin_size: The width of the histogram bins in seconds.
+    """
+    durations = episodes.engine_off_durations()
+    print(f"Stop episodes: {len(episodes)} (instead of {episodes.record_count()} records), "
+          f"with the engine switched off: {len(durations)}, total engine-off time: {durations.sum():.1f} s")
+    if len(durations):
+        print(f"Engine-off duration: mean {durations.mean():.1f} s, median {np.median(durations):.1f} s, "
+              f"max {durations.max():.1f} s")
+    counts, edges = episodes.engine_off_histogram(bin_size)
+    histogram_file = os.path.join(output_dir, ENGINE_OFF_HISTOGRAM_FILE)
+    with open(histogram_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['duration_from', 'duration_to', 'episodes'])
+        writer.writerows(zip(edges[:-1].tolist(), edges[1:].tolist(), counts.tolist()))
+    print(f"Engine-off duration histogram written in {histogram_file}")
+
+
+def create_start_stop_emissions(start_stop_data, default_totals=None, start_stop_totals=None, output_dir="results",
+                                array_format=None, cube=None):
     """
-    This function copies the original SUMO emissions XML file and replaces CO2 emission data for start-stop vehicles.
-    :param start_stop_data: Contains data of the start-stop vehicles (dictionary)
-    :param stop_times: Contains the stop time information for vehicles (dictionary)
+    This function streams the original SUMO emissions XML file and writes a copy of it in which the emission data of
+    the start-stop vehicles is replaced. The dump is processed one timestep at a time, so the memory usage does not
+    depend on the size of the emission dump. The stop episodes are merged with the timesteps of the dump: the
+    emissions of the engine-off steps are set to zero and the restart penalty is added to the emissions of the step
+    the vehicle moves again.
+    :param start_stop_data: Contains the stop episodes of the start-stop vehicles (StopEpisodes)
+    :param default_totals: Optional EmissionTotals summing up the original emissions in the same pass.
+    :param start_stop_totals: Optional EmissionTotals summing up the start-stop emissions in the same pass.
+    :param output_dir: The folder of the emission dumps.
+    :param array_format: Optional columnar format ('raw', 'npz' or 'parquet') both emission dumps are also written in.
+    :param cube: Optional EmissionCube aggregating both cases per location and time bin in the same pass.
     :return: Returns True when successfully done, or False on errors.
     """
-    if start_stop_data and stop_times:
-        original_emissions_file = "results/emissions_default.xml"
-        start_stop_emissions_file = "results/emissions_start_stop.xml"
+    if start_stop_data is not None:
+        original_emissions_file = os.path.join(output_dir, DEFAULT_EMISSIONS_FILE)
+        start_stop_emissions_file = os.path.join(output_dir, START_STOP_EMISSIONS_FILE)
 
-        # Copy the original emissions file
         if os.path.exists(original_emissions_file):
-            if copy_file(original_emissions_file, start_stop_emissions_file):
-                tree = ET.parse(start_stop_emissions_file)
-                root = tree.getroot()
-
-                for timestep in root.findall('timestep'):
-                    # Extract time attribute
-                    time = timestep.attrib['time']
-
-                    # Iterate through vehicle elements
-                    for vehicle in timestep.findall('vehicle'):
-                        # Extract id attribute
-                        vehicle_id = vehicle.attrib['id']
-                        vehicle_id = str(vehicle_id)
-
-                        # Find the vehicle id with the current timestep in the start-stop data
-                        if start_stop_data is not None:
-                            vehicle_start_stop = start_stop_data.get(vehicle_id, None)
-                            if vehicle_start_stop is not None:
-                                selected_vehicle_id = vehicle_start_stop.get(float(time), None)
-                                if selected_vehicle_id is not None:
-                                    vehicle.attrib['CO2'] = str(selected_vehicle_id['CO2'])
-                                    vehicle.attrib['CO'] = str(selected_vehicle_id['CO'])
-                                    vehicle.attrib['HC'] = str(selected_vehicle_id['HC'])
-                                    vehicle.attrib['NOx'] = str(selected_vehicle_id['NOx'])
-                                    vehicle.attrib['PMx'] = str(selected_vehicle_id['PMx'])
-
-                                else:
-                                    break
-                # Write the modified XML back to file
-                tree.write('results/emissions_start_stop.xml')
-                return True
-            else:
+            array_writers = None
+            if array_format is not None:
+                array_writers = (EmissionArrayWriter(array_path(original_emissions_file, array_format), array_format),
+                                 EmissionArrayWriter(array_path(start_stop_emissions_file, array_format),
+                                                     array_format))
+
+            timeline = start_stop_data.timeline()
+            engine_off_values = [0.0] * len(EMISSION_TYPES)
+
+            def patch_timestep(timestep):
+                time = float(timestep.attrib['time'])
+                engine_off, restart_penalties = timeline.at(start_stop_data.step_of(time))
+                if cube is not None:
+                    locations, default_rows, start_stop_rows = [], [], []
+
+                # Iterate through vehicle elements
+                for vehicle in timestep.iter('vehicle'):
+                    attrib = vehicle.attrib
+                    vehicle_id = attrib['id']
+                    emissions = read_emissions(vehicle)
+                    if default_totals is not None:
+                        default_totals.add(vehicle_id, time, emissions)
+                    if cube is not None:
+                        locations.append(cube.lane_index(attrib.get('lane', '')))
+                        default_rows.append(emissions)
+                    if array_writers is not None:
+                        array_writers[0].add(time, vehicle_id, attrib.get('lane', ''), float(attrib.get('speed', 0)),
+                                             emissions)
+
+                    # Find the vehicle id in the stop episodes of the current timestep
+                    selected_values = None
+                    if vehicle_id in engine_off:
+                        selected_values = engine_off_values
+                    elif vehicle_id in restart_penalties:
+                        selected_values = [value + penalty for value, penalty in
+                                           zip(emissions, restart_penalties[vehicle_id])]
+                    if selected_values is not None:
+                        for type, value in zip(EMISSION_TYPES, selected_values):
+                            attrib[type] = str(value)
+                        emissions = read_emissions(vehicle)
+
+                    if start_stop_totals is not None:
+                        start_stop_totals.add(vehicle_id, time, emissions)
+                    if array_writers is not None:
+                        array_writers[1].add(time, vehicle_id, attrib.get('lane', ''), float(attrib.get('speed', 0)),
+                                             emissions)
+                    if cube is not None:
+                        start_stop_rows.append(emissions)
+
+                if cube is not None:
+                    cube.add_step(time, locations, default_rows, start_stop_rows)
+
+            try:
+                transform_emission_dump(original_emissions_file, start_stop_emissions_file, patch_timestep)
+            except (OSError, ET.ParseError) as error:
+                print(f"Failed to write the start-stop emissions: {error}")
                 return False
+            finally:
+                if array_writers is not None:
+                    for writer in array_writers:
+                        writer.close()
+            return True
         else:
-            print("Missing original emissions file! (results/emissions_default.xml)")
+            print(f"Missing original emissions file! ({original_emissions_file})")
             return False
     else:
         print("Missing data in emission handling!")
         return False
 
 
-def copy_file(original_file, new_file):
+def transform_emission_dump(source_file, target_file, patch_timestep):
     """
-    This function is to copy the original emission file before modifying it with the stop-start data.
-    :param original_file: The original file to copy.
-    :param new_file: The new file's path and extension.
-    :return: True on success and False on failure.
+    This function copies a SUMO emission dump while letting the caller modify every timestep element on the way.
+    Only the timestep being processed is kept in memory: it is written to the target file and released before the
+    next one is parsed.
+    :param source_file: The SUMO emission dump to read.
+    :param target_file: The path of the modified emission dump.
+    :param patch_timestep: Function called with every timestep element before it is written.
     """
-    try:
-        with open(original_file, 'rb') as f_original:
-            with open(new_file, 'wb') as f_new:
-                # Read from the original file and write to the new file
-                f_new.write(f_original.read())
-        print(f"File '{original_file}' copied to '{new_file}' successfully.")
-        return True
-    except FileNotFoundError:
-        print("One of the files doesn't exist.")
-        return False
+    with XmlStreamWriter(target_file) as writer:
+        for timestep in iter_timesteps(source_file, writer):
+            patch_timestep(timestep)
+            writer.write(timestep)
 
 
-def calculate_cumulative_emissions():
-    # Parse the XML file
-    tree = ET.parse('results/emissions_default.xml')
-    root = tree.getroot()
+def merge_emission_dumps(segments, target_file):
+    """
+    This function merges the emission dumps of a simulation that was restarted from saved states into one dump.
+    A segment ends where the next one starts. A segment cut off by a crash is read up to its last complete timestep,
+    which is only accepted if the segment reaches the start of the next one or is the final segment.
+    :param segments: List of (emission dump, start time) pairs in the order of the restarts.
+    :param target_file: The path of the merged emission dump, it may be the dump of the first segment.
+    """
+    with XmlStreamWriter(target_file + '.tmp') as writer:
+        for index, (source_file, start_time) in enumerate(segments):
+            end_time = segments[index + 1][1] if index + 1 < len(segments) else None
+            last_time = None
+            try:
+                for timestep in iter_timesteps(source_file, writer):
+                    last_time = float(timestep.attrib['time'])
+                    if end_time is None or last_time < end_time:
+                        writer.write(timestep)
+            except ET.ParseError as error:
+                if end_time is not None and (last_time is None or last_time < end_time):
+                    raise ValueError(f"The emission dump {source_file} is cut off at {last_time} s before the start "
+                                     f"of the next segment at {end_time} s ({error}).") from error
+    os.replace(target_file + '.tmp', target_file)
+
+
+def read_emissions(vehicle):
+    """
+    Returns the emission values of a vehicle element of the SUMO emission dump in EMISSION_TYPES order.
+    """
+    attrib = vehicle.attrib
+    return [float(attrib[type]) for type in EMISSION_TYPES]
+
+
+class EmissionTotals:
+    """
+    Cumulated emissions in mg, summed up per emission type. With breakdown, the emissions are also summed up per
+    vehicle and per timestep; these sums are lists in EMISSION_TYPES order and grow with the vehicles and timesteps
+    of the dump, so they are only kept on request.
+    """
+
+    def __init__(self, breakdown=False):
+        self.breakdown = breakdown
+        self.total = [0.0] * len(EMISSION_TYPES)
+        self.per_vehicle = {}
+        self.per_timestep = {}
+
+    def add(self, vehicle_id, time, values):
+        """
+        Adds the emission values of a vehicle in the given timestep to the sums.
+        """
+        total = self.total
+        if not self.breakdown:
+            for index, value in enumerate(values):
+                total[index] += value
+            return
+        vehicle_sums = self.per_vehicle.get(vehicle_id)
+        if vehicle_sums is None:
+            vehicle_sums = self.per_vehicle[vehicle_id] = [0.0] * len(EMISSION_TYPES)
+        timestep_sums = self.per_timestep.get(time)
+        if timestep_sums is None:
+            timestep_sums = self.per_timestep[time] = [0.0] * len(EMISSION_TYPES)
+        for index, value in enumerate(values):
+            total[index] += value
+            vehicle_sums[index] += value
+            timestep_sums[index] += value
+
+    def pollutant_totals(self):
+        """
+        Returns the total emissions as a dictionary keyed by emission type.
+        """
+        return dict(zip(EMISSION_TYPES, self.total))
+
+
+class LiveEmissionTotals:
+    """
+    Running sums of the non start-stop and the start-stop emissions, updated in the simulation loop. The sums are
+    broken down per emission type, per vehicle type and per edge; the per-type and per-edge sums are pairs of lists
+    (non start-stop, start-stop) in EMISSION_TYPES order.
+    Every snapshot_interval steps, a snapshot of the sums is passed to the callback and written to the
+    snapshot_file, so long runs can be followed while they are running.
+    With a cube (EmissionCube on edge level), the emissions are also aggregated per edge and time bin.
+    """
+
+    def __init__(self, snapshot_interval=0, snapshot_file=None, callback=None, cube=None):
+        if cube is not None and cube.level != 'edge':
+            raise ValueError("The simulation loop aggregates the emissions per edge, the cube level has to be 'edge'.")
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_file = snapshot_file
+        self.callback = callback
+        self.cube = cube
+        self._cube_rows = ([], [], [])  # Locations, non start-stop and start-stop values of the current step
+        self.default = [0.0] * len(EMISSION_TYPES)
+        self.start_stop = [0.0] * len(EMISSION_TYPES)
+        self.per_type = {}
+        self.per_edge = {}
+        self.vehicle_types = {}  # Type of the vehicles in the network
+
+    def register(self, vehicle_id, vehicle_type):
+        self.vehicle_types[vehicle_id] = vehicle_type
+
+    def drop(self, vehicle_id):
+        self.vehicle_types.pop(vehicle_id, None)
+
+    @staticmethod
+    def _sums(groups, key):
+        sums = groups.get(key)
+        if sums is None:
+            sums = groups[key] = ([0.0] * len(EMISSION_TYPES), [0.0] * len(EMISSION_TYPES))
+        return sums
+
+    def add(self, vehicle_id, edge_id, default_values, start_stop_values):
+        """
+        Adds the non start-stop and the start-stop emission values of a vehicle in the current step.
+        """
+        type_default, type_start_stop = self._sums(self.per_type, self.vehicle_types.get(vehicle_id))
+        edge_default, edge_start_stop = self._sums(self.per_edge, edge_id)
+        for index, (default_value, start_stop_value) in enumerate(zip(default_values, start_stop_values)):
+            self.default[index] += default_value
+            self.start_stop[index] += start_stop_value
+            type_default[index] += default_value
+            type_start_stop[index] += start_stop_value
+            edge_default[index] += default_value
+            edge_start_stop[index] += start_stop_value
+        if self.cube is not None:
+            locations, default_rows, start_stop_rows = self._cube_rows
+            locations.append(self.cube.location_index(edge_id))
+            default_rows.append(default_values)
+            start_stop_rows.append(start_stop_values)
+
+    def snapshot(self, time=None):
+        """
+        Returns the current sums as a JSON serializable dictionary.
+        """
+        def pairs(groups):
+            return {str(key): {'default': dict(zip(EMISSION_TYPES, default)),
+                               'start_stop': dict(zip(EMISSION_TYPES, start_stop))}
+                    for key, (default, start_stop) in groups.items()}
+        return {'time': time,
+                'default': dict(zip(EMISSION_TYPES, self.default)),
+                'start_stop': dict(zip(EMISSION_TYPES, self.start_stop)),
+                'per_type': pairs(self.per_type),
+                'per_edge': pairs(self.per_edge)}
+
+    def end_step(self, step, time):
+        """
+        Takes the periodic snapshot after the given step.
+        """
+        if self.cube is not None:
+            self.cube.add_step(time, *self._cube_rows)
+            self._cube_rows = ([], [], [])
+        if not self.snapshot_interval or (step + 1) % self.snapshot_interval:
+            return
+        snapshot = self.snapshot(time)
+        if self.callback is not None:
+            self.callback(snapshot)
+        if self.snapshot_file is not None:
+            # Replace the previous snapshot at once, so readers never see a partially written file
+            with open(self.snapshot_file + '.tmp', 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(self.snapshot_file + '.tmp', self.snapshot_file)
+
+    def state(self):
+        """
+        Returns the sums and the registered vehicle types as a dictionary of arrays, which a checkpoint saves to
+        continue the sums of a resumed run (see restore). The sums of vehicles without a registered type are keyed by
+        an empty string.
+        """
+        def groups_state(groups):
+            keys = list(groups)
+            return (np.array(['' if key is None else key for key in keys], dtype=str),
+                    np.array([groups[key] for key in keys], dtype=np.float64).reshape(-1, 2, len(EMISSION_TYPES)))
+        type_keys, type_sums = groups_state(self.per_type)
+        edge_keys, edge_sums = groups_state(self.per_edge)
+        state = {'default': np.array(self.default), 'start_stop': np.array(self.start_stop),
+                 'type_keys': type_keys, 'type_sums': type_sums, 'edge_keys': edge_keys, 'edge_sums': edge_sums,
+                 'vehicle_ids': np.array(list(self.vehicle_types), dtype=str),
+                 'vehicle_types': np.array(list(self.vehicle_types.values()), dtype=str)}
+        if self.cube is not None:
+            state['cube_data'] = self.cube.data
+            state['cube_location_ids'] = np.array(self.cube.location_ids, dtype=str)
+        return state
+
+    def restore(self, state):
+        """
+        Replaces the sums and the registered vehicle types with the given state (see state).
+        """
+        def groups(keys, sums):
+            return {key or None: (default, start_stop) for key, (default, start_stop) in
+                    zip(keys.tolist(), sums.tolist())}
+        self.default = state['default'].tolist()
+        self.start_stop = state['start_stop'].tolist()
+        self.per_type = groups(state['type_keys'], state['type_sums'])
+        self.per_edge = groups(state['edge_keys'], state['edge_sums'])
+        self.vehicle_types = dict(zip(state['vehicle_ids'].tolist(), state['vehicle_types'].tolist()))
+        if self.cube is not None and 'cube_data' in state:
+            self.cube.restore(state['cube_data'], state['cube_location_ids'].tolist())
+
+    def emission_totals(self):
+        """
+        Returns the EmissionTotals of the non start-stop and the start-stop case with the per-emission type sums.
+        """
+        default_totals = EmissionTotals()
+        default_totals.total = list(self.default)
+        start_stop_totals = EmissionTotals()
+        start_stop_totals.total = list(self.start_stop)
+        return default_totals, start_stop_totals
+
+
+def sum_emission_dump(emissions_file, breakdown=False):
+    """
+    This function streams a SUMO emission dump and sums up its emissions.
+    :param emissions_file: The SUMO emission dump to read.
+    :param breakdown: If True, the emissions are also summed up per vehicle and per timestep.
+    :return: The EmissionTotals of the dump.
+    """
+    totals = EmissionTotals(breakdown)
+    for timestep in iter_timesteps(emissions_file):
+        time = float(timestep.attrib['time'])
+        for vehicle in timestep.iter('vehicle'):
+            totals.add(vehicle.attrib['id'], time, read_emissions(vehicle))
+    return totals
+
+
+def sum_emission_arrays(path, breakdown=False):
+    """
+    This function sums up the emissions of a columnar emission file (see emission_arrays) without parsing XML.
+    The sums are computed on the columns, which are memory-mapped for the raw format.
+    :param path: The path of the columnar emission file.
+    :param breakdown: If True, the emissions are also summed up per vehicle and per timestep.
+    :return: The EmissionTotals of the file.
+    """
+    arrays = load_emission_arrays(path)
+    totals = EmissionTotals(breakdown)
+    if not breakdown:
+        for index, type in enumerate(EMISSION_TYPES):
+            totals.total[index] = float(arrays[type].sum())
+        return totals
+    vehicles = arrays['vehicle']
+    times = arrays['time']
+    # The rows are in timestep order, so every timestep is a contiguous block
+    timestep_starts = np.concatenate(([0], np.flatnonzero(np.diff(times)) + 1)) if len(times) else np.empty(0, int)
+    vehicle_sums = []
+    timestep_sums = []
+    for index, type in enumerate(EMISSION_TYPES):
+        column = arrays[type]
+        totals.total[index] = float(column.sum())
+        vehicle_sums.append(np.bincount(vehicles, weights=column, minlength=len(arrays['vehicle_ids'])).tolist())
+        timestep_sums.append(np.add.reduceat(column, timestep_starts).tolist() if len(times) else [])
+    totals.per_vehicle = {vehicle_id: list(sums) for vehicle_id, sums in zip(arrays['vehicle_ids'], zip(*vehicle_sums))}
+    totals.per_timestep = {time: list(sums) for time, sums in zip(times[timestep_starts].tolist(), zip(*timestep_sums))}
+    return totals
 
-    # Initialize sums for each emission type
-    sum_CO2 = 0
-    sum_CO = 0
-    sum_HC = 0
-    sum_NOx = 0
-    sum_PMx = 0
-
-    # Iterate through each timestep
-    for timestep in root.findall('timestep'):
-        # Iterate through each vehicle within the timestep
-        for vehicle in timestep.findall('vehicle'):
-            # Extract and sum the values for each emission type
-            sum_CO2 += float(vehicle.get('CO2'))
-            sum_CO += float(vehicle.get('CO'))
-            sum_HC += float(vehicle.get('HC'))
-            sum_NOx += float(vehicle.get('NOx'))
-            sum_PMx += float(vehicle.get('PMx'))
+
+def save_emission_cube(cube, output_dir="results"):
+    """
+    This function writes the EmissionCube of a run into the output_dir and prints its CO2 hotspots.
+    """
+    if cube is None:
+        return
+    cube.save(os.path.join(output_dir, EMISSION_CUBE_FILE))
+    print(f"Emission cube written in {os.path.join(output_dir, EMISSION_CUBE_FILE)}")
+    print(f"Largest start-stop CO2 differences per {cube.level}:")
+    for location_id, value in cube.hotspots('CO2', 'delta', 5):
+        print(f"{location_id}: {value} mg")
+
+
+def calculate_cumulative_emissions(default_totals=None, start_stop_totals=None, output_dir="results", plot=True,
+                                   array_format=None):
+    """
+    This function prints and plots the cumulated emissions of the non start-stop and the start-stop case. The totals
+    collected while writing the start-stop emission dump are used when given, the emission dumps are only read
+    when they are missing. With array_format, the columnar files of the dumps are read instead of the XML dumps.
+    :param default_totals: EmissionTotals of emissions_default.xml, or None to read the dump.
+    :param start_stop_totals: EmissionTotals of emissions_start_stop.xml, or None to read the dump.
+    :param output_dir: The folder of the emission dumps.
+    :param plot: If False, the bar plot is not shown (eg. for batch runs).
+    :param array_format: The columnar format ('raw', 'npz' or 'parquet') of the dumps to read, None reads the XML.
+    :return: The totals of the non start-stop and the start-stop case.
+    """
+    def read_totals(xml_file):
+        if array_format is not None:
+            return sum_emission_arrays(array_path(xml_file, array_format))
+        return sum_emission_dump(xml_file)
+
+    if default_totals is None:
+        default_totals = read_totals(os.path.join(output_dir, DEFAULT_EMISSIONS_FILE))
+    if start_stop_totals is None:
+        start_stop_totals = read_totals(os.path.join(output_dir, START_STOP_EMISSIONS_FILE))
+
+    sums = default_totals.pollutant_totals()
+    sums_start_stop = start_stop_totals.pollutant_totals()
 
     # Print the sum of each emission type
     print("------------------------------")
     print("Cumulated emissions for non start-stop case:")
-    print("Sum of CO2:", sum_CO2, "mg")
-    print("Sum of CO:", sum_CO, "mg")
-    print("Sum of HC:", sum_HC, "mg")
-    print("Sum of NOx:", sum_NOx, "mg")
-    print("Sum of PMx:", sum_PMx, "mg")
-
-    # Parse the XML file
-    tree = ET.parse('results/emissions_start_stop.xml')
-    root = tree.getroot()
+    for type in EMISSION_TYPES:
+        print(f"Sum of {type}:", sums[type], "mg")
 
-    # Initialize sums for each emission type
-    sum_CO2_start_stop = 0
-    sum_CO_start_stop = 0
-    sum_HC_start_stop = 0
-    sum_NOx_start_stop = 0
-    sum_PMx_start_stop = 0
-
-    # Iterate through each timestep
-    for timestep in root.findall('timestep'):
-        # Iterate through each vehicle within the timestep
-        for vehicle in timestep.findall('vehicle'):
-            # Extract and sum the values for each emission type
-            sum_CO2_start_stop += float(vehicle.get('CO2'))
-            sum_CO_start_stop += float(vehicle.get('CO'))
-            sum_HC_start_stop += float(vehicle.get('HC'))
-            sum_NOx_start_stop += float(vehicle.get('NOx'))
-            sum_PMx_start_stop += float(vehicle.get('PMx'))
-
-    # Print the sum of each emission type
     print("------------------------------")
     print("Cumulated emissions for start-stop case:")
-    print("Sum of CO2:", sum_CO2_start_stop, "mg")
-    print("Sum of CO:", sum_CO_start_stop, "mg")
-    print("Sum of HC:", sum_HC_start_stop, "mg")
-    print("Sum of NOx:", sum_NOx_start_stop, "mg")
-    print("Sum of PMx:", sum_PMx_start_stop, "mg")
+    for type in EMISSION_TYPES:
+        print(f"Sum of {type}:", sums_start_stop[type], "mg")
+
     print("------------------------------")
     print("Absolute differences:")
-    print("Difference of CO2:", abs(sum_CO2_start_stop - sum_CO2), "mg")
-    print("Difference of CO:", abs(sum_CO_start_stop - sum_CO), "mg")
-    print("Difference of HC:", abs(sum_HC_start_stop - sum_HC), "mg")
-    print("Difference of NOx:", abs(sum_NOx_start_stop - sum_NOx), "mg")
-    print("Difference of PMx:", abs(sum_PMx_start_stop - sum_PMx), "mg")
-
-    categories = ['CO2', 'CO', 'HC', 'NOx', 'PMx']
-    values = [abs(sum_CO2_start_stop - sum_CO2), abs(sum_CO_start_stop - sum_CO), abs(sum_HC_start_stop - sum_HC),
-              abs(sum_NOx_start_stop - sum_NOx), abs(sum_PMx_start_stop - sum_PMx)]
+    values = [abs(sums_start_stop[type] - sums[type]) for type in EMISSION_TYPES]
+    for type, value in zip(EMISSION_TYPES, values):
+        print(f"Difference of {type}:", value, "mg")
+
+    if not plot:
+        return default_totals, start_stop_totals
+
     # Create bar graph
-    plt.bar(categories, values, color='skyblue')
+    plt.bar(EMISSION_TYPES, values, color='skyblue')
 
     # Adding title and labels
     plt.title('Absolute difference of total emissions')
@@ -392,4 +1103,4 @@ def calculate_cumulative_emissions():
 
     # Show the plot
     plt.show()
-    return
+    return default_totals, start_stop_totals
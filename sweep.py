@@ -0,0 +1,220 @@
+import csv
+import itertools
+import numpy as np
+import startstop as Stp
+from emission_store import IdIndex
+from idle_rates import IdleRateTable
+from xml_stream import iter_timesteps
+
+"""
+ Parameter sweep of the start-stop model on a recorded emission dump.
+ The trajectories of the dump are loaded once into NumPy arrays and the stops are run-length encoded once. Every
+ combination of start-stop ratio, engine-off threshold, idle time and idle values is then evaluated on these arrays,
+ without re-running SUMO or re-reading the dump.
+"""
+
+
+class Trajectories:
+    """
+     The vehicle steps of an emission dump as NumPy arrays, sorted by vehicle and step. The vehicles are indexed in
+     the order of their first appearance, which is the order the start-stop vehicles are assigned in.
+    """
+
+    def __init__(self, vehicle_ids, vehicle_types, vehicles, steps, speeds, emissions, vehicle_classes=None):
+        self.vehicle_ids = vehicle_ids
+        self.vehicle_types = vehicle_types
+        self.vehicle_classes = vehicle_classes if vehicle_classes is not None else [None] * len(vehicle_ids)
+        order = np.lexsort((steps, vehicles))
+        self.vehicles = vehicles[order]
+        self.steps = steps[order]
+        self.speeds = speeds[order]
+        self.emissions = emissions[order]
+
+
+def load_trajectories(emissions_file, steptime):
+    """
+     A function to stream a SUMO emission dump into Trajectories.
+     :param emissions_file: The SUMO emission dump to read.
+     :param steptime: The step length of the simulation that created the dump in seconds.
+     :return: The Trajectories of the dump.
+    """
+    vehicle_index = IdIndex()
+    vehicle_types = []
+    vehicle_classes = []
+    vehicles = []
+    steps = []
+    speeds = []
+    emissions = []
+    for timestep in iter_timesteps(emissions_file):
+        step = int(round(float(timestep.attrib['time']) / steptime))
+        for vehicle in timestep.iter('vehicle'):
+            attrib = vehicle.attrib
+            vehicle_id = attrib['id']
+            index = vehicle_index.intern(vehicle_id)
+            if index == len(vehicle_types):
+                vehicle_types.append(attrib.get('type'))
+                vehicle_classes.append(attrib.get('eclass'))
+            vehicles.append(index)
+            steps.append(step)
+            speeds.append(float(attrib['speed']))
+            emissions.append(Stp.read_emissions(vehicle))
+    return Trajectories(vehicle_index.ids, vehicle_types, np.array(vehicles, dtype=np.int32),
+                        np.array(steps, dtype=np.int32), np.array(speeds, dtype=np.float64),
+                        np.array(emissions, dtype=np.float64).reshape(-1, len(Stp.EMISSION_TYPES)), vehicle_classes)
+
+
+class StopRuns:
+    """
+     Run-length encoding of the stops in the Trajectories. A run is a sequence of consecutive stopped steps (below
+     startstop.STOP_SPEED) of a vehicle; it has a restart if the vehicle moves again in the dump. Unlike the stop
+     episodes of the simulation (emission_store.StopEpisodes), the runs do not depend on the engine-off threshold, so
+     they are encoded once for every threshold of the sweep.
+    """
+
+    def __init__(self, trajectories):
+        vehicles = trajectories.vehicles
+        stopped = trajectories.speeds < Stp.STOP_SPEED
+        same_vehicle = np.zeros(len(vehicles), dtype=bool)
+        same_vehicle[1:] = vehicles[1:] == vehicles[:-1]
+
+        # A run starts on a stopped step that does not continue a stop of the same vehicle
+        previous_stopped = np.zeros(len(vehicles), dtype=bool)
+        previous_stopped[1:] = stopped[:-1]
+        starts = np.flatnonzero(stopped & ~(same_vehicle & previous_stopped))
+        next_stopped = np.zeros(len(vehicles), dtype=bool)
+        next_stopped[:-1] = stopped[1:] & same_vehicle[1:]
+        ends = np.flatnonzero(stopped & ~next_stopped) + 1
+
+        self.vehicles = vehicles[starts]
+        self.starts = starts
+        self.lengths = ends - starts
+        restarts = np.zeros(len(starts), dtype=bool)
+        inside = ends < len(vehicles)
+        restarts[inside] = same_vehicle[ends[inside]]
+        self.restarts = restarts
+
+        # Prefix sums of the emissions to sum up any part of a run in constant time
+        self.emission_sums = np.zeros((len(vehicles) + 1, trajectories.emissions.shape[1]))
+        np.cumsum(trajectories.emissions, axis=0, out=self.emission_sums[1:])
+
+    def engine_off_emissions(self, steptime, engine_off_threshold):
+        """
+         Returns the emissions of every run in the steps where the engine is switched off (runs x emission types).
+         The engine is off in the k-th step of a stop if k * steptime exceeds the engine-off threshold.
+        """
+        step_counts = np.arange(1, self.lengths.max(initial=0) + 1)
+        first_off_step = np.searchsorted(step_counts * steptime > engine_off_threshold, True)
+        first_off_row = np.minimum(self.starts + first_off_step, self.starts + self.lengths)
+        return self.emission_sums[self.starts + self.lengths] - self.emission_sums[first_off_row]
+
+    def penalized_restarts(self, steptime, engine_off_threshold):
+        """
+         Returns which runs end with a restart that adds the idle emissions.
+        """
+        return self.restarts & (self.lengths * steptime >= engine_off_threshold)
+
+
+def start_stop_assignment(trajectories, start_stop_ratios, ratio_based_simulation=True, assignment_seed=None):
+    """
+     A function to assign the vehicles to the start-stop group for every ratio with the rule of StartStopController.
+     The seeded assignment does not depend on the order of the vehicles, it is computed for every ratio at once.
+     :return: Boolean matrix (ratios x vehicles) of the start-stop vehicles.
+    """
+    if assignment_seed is not None:
+        shares = np.array([Stp.assignment_share(vehicle_id, assignment_seed)
+                           for vehicle_id in trajectories.vehicle_ids])
+        typed = np.array([Stp.is_start_stop_type(vehicle_type) for vehicle_type in trajectories.vehicle_types],
+                         dtype=bool)
+        by_ratio = shares[None, :] < np.asarray(start_stop_ratios, dtype=np.float64)[:, None] / 100.0
+        return (by_ratio & ratio_based_simulation) | typed[None, :]
+    assignment = np.zeros((len(start_stop_ratios), len(trajectories.vehicle_ids)), dtype=bool)
+    for row, start_stop_ratio in enumerate(start_stop_ratios):
+        controller = Stp.StartStopController(1, start_stop_ratio, ratio_based_simulation, 0, Stp.DEFAULT_IDLE_VALUES)
+        for index, (vehicle_id, vehicle_type) in enumerate(zip(trajectories.vehicle_ids, trajectories.vehicle_types)):
+            assignment[row, index] = controller.assign(vehicle_id, vehicle_type)
+    return assignment
+
+
+def sweep(trajectories, steptime, start_stop_ratios, engine_off_thresholds, idle_times, idle_value_sets=None,
+          ratio_based_simulation=True, assignment_seed=None):
+    """
+     A function to evaluate the start-stop model for every combination of the given parameters.
+     :param trajectories: The recorded Trajectories.
+     :param steptime: The step length of the recorded simulation in seconds.
+     :param start_stop_ratios: The start-stop ratios in %.
+     :param engine_off_thresholds: The engine-off thresholds in seconds.
+     :param idle_times: The idle times after an engine restart in seconds.
+     :param idle_value_sets: List of idle value dictionaries or IdleRateTables (rates per emission class), None uses
+      the default idle values.
+     :param ratio_based_simulation: If False, only the "start-stop-vehicle" type is assigned to the start-stop group.
+     :param assignment_seed: Optional seed of the hash-based start-stop assignment.
+     :return: The start-stop totals (ratios x thresholds x idle times x idle value sets x emission types) and the
+      totals of the recording (emission types).
+    """
+    if idle_value_sets is None:
+        idle_value_sets = [None]
+    idle_times = np.asarray(idle_times, dtype=np.float64)
+    vehicle_count = len(trajectories.vehicle_ids)
+    emission_count = len(Stp.EMISSION_TYPES)
+
+    # Idle rates of every vehicle for every idle value set (idle value sets x vehicles x emission types), a table
+    # gives every vehicle the rates of its emission class
+    vehicle_rates = np.empty((len(idle_value_sets), vehicle_count, emission_count))
+    for row, values in enumerate(idle_value_sets):
+        if isinstance(values, IdleRateTable):
+            vehicle_rates[row] = values.lookup(trajectories.vehicle_classes)
+        else:
+            values = Stp.complete_idle_values(values)
+            vehicle_rates[row] = [values[type] for type in Stp.EMISSION_TYPES]
+
+    runs = StopRuns(trajectories)
+    assignment = start_stop_assignment(trajectories, start_stop_ratios, ratio_based_simulation,
+                                       assignment_seed).astype(np.float64)
+
+    # Engine-off savings and penalized restarts per vehicle for every threshold
+    savings = np.zeros((len(engine_off_thresholds), vehicle_count, emission_count))
+    restarts = np.zeros((len(engine_off_thresholds), vehicle_count))
+    for row, engine_off_threshold in enumerate(engine_off_thresholds):
+        np.add.at(savings[row], runs.vehicles, runs.engine_off_emissions(steptime, engine_off_threshold))
+        np.add.at(restarts[row], runs.vehicles, runs.penalized_restarts(steptime, engine_off_threshold))
+
+    # Combine with the start-stop groups of the ratios: (ratios x thresholds x emission types) and the idle rates of
+    # the restarts (ratios x thresholds x idle value sets x emission types)
+    saved = np.einsum('rv,tve->rte', assignment, savings)
+    restart_rates = np.einsum('rv,tv,sve->rtse', assignment, restarts, vehicle_rates, optimize=True)
+
+    default_totals = trajectories.emissions.sum(axis=0)
+    penalties = restart_rates[:, :, None, :, :] * idle_times[None, None, :, None, None]
+    start_stop_totals = default_totals - saved[:, :, None, None, :] + penalties
+    return start_stop_totals, default_totals
+
+
+def sweep_table(start_stop_totals, default_totals, start_stop_ratios, engine_off_thresholds, idle_times,
+                idle_value_sets=None):
+    """
+     Converts the result of sweep into a tidy table, one row per parameter combination and emission type.
+     The idle values are referred to by their index in idle_value_sets.
+    """
+    if idle_value_sets is None:
+        idle_value_sets = [None]
+    rows = []
+    for (r, ratio), (t, threshold), (i, idle_time), v in itertools.product(
+            enumerate(start_stop_ratios), enumerate(engine_off_thresholds), enumerate(idle_times),
+            range(len(idle_value_sets))):
+        for e, type in enumerate(Stp.EMISSION_TYPES):
+            start_stop_total = float(start_stop_totals[r, t, i, v, e])
+            rows.append({'start_stop_ratio': ratio, 'engine_off_threshold': threshold, 'idle_time_in_sec': idle_time,
+                         'idle_values': v, 'emission_type': type, 'default_total': float(default_totals[e]),
+                         'start_stop_total': start_stop_total,
+                         'difference': start_stop_total - float(default_totals[e])})
+    return rows
+
+
+def write_sweep_table(rows, csv_file):
+    """
+     Writes the rows of sweep_table into a CSV file.
+    """
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+
+# The modules of the repository are imported from its root folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import traci
+
+
+class FakeSumo:
+    """
+     Stand-in for starting SUMO through traci.start: every started connection is a benchmark.MockTraci serving the
+     given synthetic scenario, and the emission output requested on the command line is written from the scenario.
+     A state given with --load-state is loaded into the new connection.
+     Connections whose label is in fail_labels lose the connection to SUMO in the given step.
+    """
+
+    def __init__(self, scenario, fail_labels=(), fail_step=5):
+        self.scenario = scenario
+        self.fail_labels = set(fail_labels)
+        self.fail_step = fail_step
+        self.connections = {}
+
+    def start(self, cmd, label="default", **kwargs):
+        if "--emission-output" in cmd:
+            self.scenario.write_emission_dump(cmd[cmd.index("--emission-output") + 1])
+        conn = benchmark.MockTraci(self.scenario)
+        if "--load-state" in cmd:
+            conn.load_state(cmd[cmd.index("--load-state") + 1])
+        if label in self.fail_labels:
+            simulation_step = conn.simulationStep
+
+            def failing_step():
+                if conn.step + 1 == self.fail_step:
+                    raise traci.exceptions.FatalTraCIError("connection closed by SUMO")
+                simulation_step()
+            conn.simulationStep = failing_step
+        self.connections[label] = conn
+
+    def getConnection(self, label="default"):
+        return self.connections[label]
+
+
+@pytest.fixture
+def fake_sumo(monkeypatch):
+    """
+     Replaces traci.start and traci.getConnection by a FakeSumo serving a small synthetic scenario.
+    """
+    sumo = FakeSumo(benchmark.SyntheticScenario(20, 30, stop_period=11, stop_length=6, departure_steps=10,
+                                                trip_steps=15))
+    monkeypatch.setattr(traci, "start", sumo.start)
+    monkeypatch.setattr(traci, "getConnection", sumo.getConnection)
+    return sumo
@@ -0,0 +1,49 @@
+import xml.etree.ElementTree as ET
+import assignment
+import startstop as Stp
+
+"""
+ Tests of the precomputed start-stop assignment of a route file.
+"""
+
+ROUTES = """<routes>
+    <vType id="car" accel="2.6" emissionClass="HBEFA4/PC_petrol_Euro-4">
+        <param key="device.battery.capacity" value="0"/>
+        <carFollowing-IDM delta="4"/>
+    </vType>
+    <vehicle id="v0" type="car" depart="0"><route edges="e1 e2"/></vehicle>
+    <vehicle id="v1" type="car" depart="1"><route edges="e1 e2"/></vehicle>
+    <vehicle id="v2" type="car" depart="2"><route edges="e1 e2"/></vehicle>
+    <vehicle id="v3" type="car" depart="3"><route edges="e1 e2"/></vehicle>
+    <flow id="f0" type="car" begin="0" end="10" number="5" from="e1" to="e2"/>
+</routes>
+"""
+
+
+def test_precomputed_assignment(tmp_path):
+    route_file = tmp_path / "routes.rou.xml"
+    route_file.write_text(ROUTES)
+    output_file = tmp_path / "routes_start_stop.rou.xml"
+
+    counts = assignment.precompute_assignment(str(route_file), str(output_file), 50, 42)
+
+    routes = ET.parse(output_file).getroot()
+    types = {element.attrib['id']: element for element in routes.iter('vType')}
+    original, copy = types['car'], types['car' + Stp.START_STOP_TYPE_SUFFIX]
+    # The copy keeps the parameters and child elements of the type
+    assert {key: value for key, value in copy.attrib.items() if key != 'id'} == \
+        {key: value for key, value in original.attrib.items() if key != 'id'}
+    assert [(child.tag, child.attrib) for child in copy] == [(child.tag, child.attrib) for child in original]
+
+    start_stop_vehicles = {vehicle.attrib['id'] for vehicle in routes.iter('vehicle')
+                           if vehicle.attrib['type'] == copy.attrib['id']}
+    assert start_stop_vehicles == {f"v{index}" for index in range(4)
+                                   if Stp.assignment_share(f"v{index}", 42) < 0.5}
+    assert counts == {'vehicles': 4, 'start_stop_vehicles': len(start_stop_vehicles), 'unknown_types': 0, 'flows': 1}
+
+    # The flow draws its vehicles from the type and its copy
+    distribution = routes.find('vTypeDistribution')
+    assert distribution.attrib['vTypes'].split() == ['car', copy.attrib['id']]
+    assert distribution.attrib['probabilities'].split() == ['0.5', '0.5']
+    assert routes.find('flow').attrib['type'] == distribution.attrib['id']
+    assert list(routes).index(distribution) < list(routes).index(routes.find('flow'))
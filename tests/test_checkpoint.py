@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import traci
+import benchmark
+import startstop as Stp
+from checkpoint import Checkpointer
+from emission_cube import EmissionCube
+from xml_stream import iter_timesteps
+
+"""
+ Checkpoint/resume of a run without emission dumps on the fake SUMO of conftest.py: the run that crashed and was
+ resumed from its checkpoint reports the same live totals and cube as an uninterrupted run. The emission dumps of the
+ restarts are merged, and a dump cut off before the start of the next one is an error.
+"""
+
+
+def run(output_dir, label, checkpointer=None):
+    live_totals = Stp.LiveEmissionTotals(cube=EmissionCube(bin_size=10))
+    Stp.run_simulation("scenario.sumocfg", 30, 1.0, 50, True, 7, output_dir=str(output_dir), gui=False, label=label,
+                       plot=False, live_totals=live_totals, write_dumps=False, checkpointer=checkpointer)
+    return live_totals
+
+
+def test_resumed_live_totals_match_uninterrupted_run(tmp_path, fake_sumo):
+    expected = run(tmp_path / "uninterrupted", "uninterrupted")
+
+    fake_sumo.fail_labels.add("crashed")
+    fake_sumo.fail_step = 17
+    with pytest.raises(traci.exceptions.FatalTraCIError):
+        run(tmp_path / "resumed", "crashed", Checkpointer(str(tmp_path / "checkpoints"), 5))
+    resumed = run(tmp_path / "resumed", "resumed", Checkpointer(str(tmp_path / "checkpoints"), 5, resume=True))
+
+    assert resumed.emission_totals()[0].total == expected.emission_totals()[0].total
+    assert resumed.emission_totals()[1].total == expected.emission_totals()[1].total
+    expected_state, resumed_state = expected.state(), resumed.state()
+    assert expected_state.keys() == resumed_state.keys()
+    for name in expected_state:
+        assert np.array_equal(resumed_state[name], expected_state[name]), name
+
+
+def test_merge_rejects_dump_cut_off_before_next_segment(tmp_path):
+    dump = tmp_path / "emissions.xml"
+    benchmark.SyntheticScenario(8, 40, departure_steps=10, trip_steps=25).write_emission_dump(dump)
+    content = dump.read_text()
+    truncated = tmp_path / "truncated.xml"
+    truncated.write_text(content[:content.index('<timestep time="20.00"')])
+
+    merged = tmp_path / "merged.xml"
+    Stp.merge_emission_dumps([(str(truncated), 0.0), (str(dump), 10.0)], str(merged))
+    assert len(list(iter_timesteps(str(merged)))) == 10 + 40
+    # The final segment may be cut off, a segment before it only after the start of the next one
+    Stp.merge_emission_dumps([(str(dump), 0.0), (str(truncated), 10.0)], str(merged))
+    with pytest.raises(ValueError):
+        Stp.merge_emission_dumps([(str(truncated), 0.0), (str(dump), 30.0)], str(merged))
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import traci.constants as tc
+import benchmark
+import cosim
+import startstop as Stp
+
+"""
+ Tests of the start-stop step listener inside the loop of another TraCI client (the owner) that subscribes the
+ vehicles to variables of its own on the same connection.
+"""
+
+
+def scenario():
+    return benchmark.SyntheticScenario(20, 30, stop_period=11, stop_length=6, departure_steps=10, trip_steps=15)
+
+
+def run_owner(listener, conn, steps):
+    """The loop of a routing client: it subscribes every departed vehicle to its edge after the listener ran."""
+    for _ in range(steps):
+        conn.simulationStep()
+        listener.step()
+        for vehicle_id in conn.simulation.getDepartedIDList():
+            conn.vehicle.subscribe(vehicle_id, [tc.VAR_ROAD_ID])
+        for values in conn.vehicle.getAllSubscriptionResults().values():
+            assert list(values) == [tc.VAR_ROAD_ID]
+    listener.cleanUp()
+
+
+def recorder():
+    controller = Stp.StartStopController(1.0, 50, True, 7, Stp.complete_idle_values())
+    return Stp.StartStopRecorder(controller)
+
+
+def test_listener_next_to_subscribing_owner():
+    expected = Stp.simulate_start_stop(benchmark.MockTraci(scenario()), 30, 1.0, 50, True, 7,
+                                       Stp.complete_idle_values())
+    listener = cosim.StartStopListener(benchmark.MockTraci(scenario()), recorder())
+    run_owner(listener, listener.conn, 30)
+    assert len(listener.recorder.episodes) > 0
+    assert np.array_equal(listener.recorder.episodes.rows(), expected.rows())
+    assert listener.recorder.episodes.vehicle_ids == expected.vehicle_ids
+
+
+def test_subscribing_listener_detects_replaced_subscriptions():
+    listener = cosim.StartStopListener(benchmark.MockTraci(scenario()), recorder(), use_subscriptions=True)
+    with pytest.raises(ValueError):
+        run_owner(listener, listener.conn, 30)
+
+
+def test_subscribing_listener_skips_vehicles_of_owner():
+    conn = benchmark.MockTraci(scenario())
+    listener = cosim.StartStopListener(conn, recorder(), use_subscriptions=True)
+    conn.simulationStep()
+    # A vehicle the owner subscribed before the listener saw it departing
+    conn.vehicle.subscribe("veh0", [tc.VAR_ROAD_ID])
+    conn.simulation.getDepartedIDList = lambda: []
+    listener.step()
+    assert listener.recorder.controller.total_vehicles_processed == 0
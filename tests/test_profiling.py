@@ -0,0 +1,38 @@
+import benchmark
+import startstop as Stp
+from checkpoint import Checkpointer
+from idle_rates import IdleRateTable
+from profiling import PHASES, StepProfiler
+
+"""
+ Tests of the profiler of the simulation loop on the mocked TraCI backend: every TraCI call is counted, also the calls
+ of the vehicle type domain, and the phases of a step add up to its wall time.
+"""
+
+
+class CallCountingTraci(benchmark.MockTraci):
+    """MockTraci counting its round-trips, the calls the profiler has to count."""
+
+    def round_trip(self):
+        super().round_trip()
+        self.calls = getattr(self, 'calls', 0) + 1
+
+
+def test_profiler_counts_calls_and_splits_phases(tmp_path):
+    scenario = benchmark.SyntheticScenario(20, 30, stop_period=11, stop_length=6, departure_steps=10, trip_steps=15)
+    server = CallCountingTraci(scenario)
+    profiler = StepProfiler(memory_interval=1)
+    idle_rates = IdleRateTable({benchmark.EMISSION_CLASS: dict(Stp.DEFAULT_IDLE_VALUES)})
+    Stp.simulate_start_stop(server, scenario.steps, 1.0, 50, True, 7, Stp.complete_idle_values(), profiler=profiler,
+                            live_totals=Stp.LiveEmissionTotals(), idle_rates=idle_rates,
+                            checkpointer=Checkpointer(str(tmp_path), 10))
+
+    # The simulation steps are round-trips of the mock as well
+    assert profiler.traci_calls == server.calls + scenario.steps
+    assert len(profiler.records) == scenario.steps
+    for record in profiler.records:
+        assert abs(sum(record[phase] for phase in PHASES) - record['wall_time']) < 1e-9
+    phase_times = profiler.summary()['phase_times']
+    assert phase_times['start_stop'] > 0 and phase_times['bookkeeping'] > 0
+    # Only the steps with a checkpoint have a checkpoint phase
+    assert 0 < sum(record['checkpoint'] > 0 for record in profiler.records) < scenario.steps
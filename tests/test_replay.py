@@ -0,0 +1,60 @@
+import filecmp
+import os
+import shutil
+import pytest
+import benchmark
+import replay
+import startstop as Stp
+
+"""
+ Equivalence of the TraCI simulation and the offline replay. The fixture dumps are the SUMO emission output of the
+ synthetic scenarios below, which MockTraci serves to the simulation loop; both state machines have to write the
+ same start-stop dump from it. In the creeping scenario, the start-stop vehicles creep below the precision of the dump,
+ so the simulation sees a speed the dump writes as 0.00.
+"""
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURES = {'standing': ("emissions_replay.xml", 0.0),
+            'creeping': ("emissions_replay_creeping.xml", 0.003)}
+
+
+def fixture_scenario(fixture):
+    creep_speed = FIXTURES[fixture][1]
+    return benchmark.SyntheticScenario(8, 40, stop_period=11, stop_length=6, departure_steps=10, trip_steps=25,
+                                       creep_speed=creep_speed)
+
+
+def fixture_dump(fixture):
+    return os.path.join(FIXTURE_DIR, FIXTURES[fixture][0])
+
+
+@pytest.mark.parametrize("fixture", FIXTURES)
+def test_fixture_matches_scenario(tmp_path, fixture):
+    dump = tmp_path / Stp.DEFAULT_EMISSIONS_FILE
+    fixture_scenario(fixture).write_emission_dump(dump)
+    assert filecmp.cmp(dump, fixture_dump(fixture), shallow=False)
+
+
+@pytest.mark.parametrize("fixture", FIXTURES)
+@pytest.mark.parametrize("ratio_based_simulation, assignment_seed, engine_off_threshold", [
+    (True, None, 2),
+    (True, 42, 2),
+    (False, None, 2),
+    (True, None, 4.5),
+])
+def test_replay_matches_simulation(tmp_path, fixture, ratio_based_simulation, assignment_seed, engine_off_threshold):
+    scenario = fixture_scenario(fixture)
+    dump = fixture_dump(fixture)
+    simulated_dir = tmp_path / "simulated"
+    simulated_dir.mkdir()
+    shutil.copy(dump, simulated_dir / Stp.DEFAULT_EMISSIONS_FILE)
+    episodes = Stp.simulate_start_stop(benchmark.MockTraci(scenario), scenario.steps, 1.0, 50, ratio_based_simulation,
+                                       7, Stp.complete_idle_values(), engine_off_threshold=engine_off_threshold,
+                                       assignment_seed=assignment_seed)
+    assert len(episodes) > 0
+    assert Stp.create_start_stop_emissions(episodes, output_dir=str(simulated_dir))
+
+    replayed_dump = tmp_path / "replayed.xml"
+    assert replay.replay_start_stop(1.0, 50, ratio_based_simulation, 7, None, dump, str(replayed_dump),
+                                    engine_off_threshold=engine_off_threshold, assignment_seed=assignment_seed)
+    assert filecmp.cmp(simulated_dir / Stp.START_STOP_EMISSIONS_FILE, replayed_dump, shallow=False)
@@ -0,0 +1,72 @@
+import csv
+import os
+import pytest
+import runner
+
+"""
+ Tests of the batch runner on the fake SUMO of conftest.py: a failing scenario is reported in the summary without
+ aborting the batch, and its TraCI connection is closed. Every scenario has its own run folder.
+"""
+
+SUMOCFG = """<configuration>
+    <time>
+        <begin value="0"/>
+        <end value="30"/>
+        <step-length value="1"/>
+    </time>
+</configuration>
+"""
+
+
+class SerialPool:
+    """Runs the scenarios in the test process, where the fake SUMO is installed."""
+
+    def __init__(self, processes=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap(self, function, iterable):
+        return map(function, iterable)
+
+
+def test_failed_scenario_does_not_abort_batch(tmp_path, monkeypatch, fake_sumo):
+    sumocfg = tmp_path / "scenario.sumocfg"
+    sumocfg.write_text(SUMOCFG)
+    failing = runner.scenario_name(str(sumocfg), 2, 50)
+    fake_sumo.fail_labels.add(failing)
+    monkeypatch.setattr(runner, "Pool", SerialPool)
+
+    rows = runner.run_batch([str(sumocfg)], [1, 2, 3], [50], str(tmp_path / "batch"))
+
+    with open(os.path.join(tmp_path, "batch", "summary.csv"), newline='') as f:
+        summary = list(csv.DictReader(f))
+    assert len(rows) == len(summary) == 2 * 5 + 1
+    failed = [row for row in summary if row['status'] == 'failed']
+    assert [row['scenario'] for row in failed] == [failing]
+    assert "FatalTraCIError" in failed[0]['error']
+    assert all(row['status'] == 'ok' and row['default_total'] for row in summary if row['scenario'] != failing)
+    # Every connection is closed, also the one of the failed scenario
+    assert len(fake_sumo.connections) == 3
+    assert all(conn.closed for conn in fake_sumo.connections.values())
+
+
+def test_scenario_names_are_unique(tmp_path, monkeypatch, fake_sumo):
+    sumocfgs = []
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        sumocfg = tmp_path / folder / "scenario.sumocfg"
+        sumocfg.write_text(SUMOCFG)
+        sumocfgs.append(str(sumocfg))
+    monkeypatch.setattr(runner, "Pool", SerialPool)
+
+    rows = runner.run_batch(sumocfgs, [1], [50], str(tmp_path / "batch"))
+
+    assert len({row['output_dir'] for row in rows}) == 2
+    assert all(os.path.isdir(row['output_dir']) for row in rows)
+    with pytest.raises(ValueError):
+        runner.run_batch(sumocfgs + sumocfgs[:1], [1], [50], str(tmp_path / "batch"))
@@ -0,0 +1,100 @@
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+"""
+ Streaming of SUMO XML files (emission dumps, route files) one top-level element at a time. Only the element being
+ processed is kept in memory, it is released once the caller moves on to the next one.
+"""
+
+
+def iter_children(xml_file, writer=None):
+    """
+     A generator of the top-level elements of an XML file (the children of its root element) in file order. Every
+     element is complete when it is yielded and is released before the next one is parsed.
+     A truncated file raises ET.ParseError after its last complete element.
+     :param xml_file: The XML file to read.
+     :param writer: An XmlStreamWriter that is opened with the root element of the file before its first child.
+    """
+    namespaces = {}
+    root = None
+    depth = 0
+    for event, item in ET.iterparse(xml_file, events=('start-ns', 'start', 'end')):
+        if event == 'start-ns':
+            prefix, uri = item
+            namespaces[uri] = prefix
+        elif event == 'start':
+            depth += 1
+            if root is None:
+                root = item
+                if writer is not None:
+                    writer.begin(root, namespaces)
+        else:
+            depth -= 1
+            if depth == 1:
+                yield item
+                # Release the processed element
+                root.clear()
+
+
+def iter_timesteps(emissions_file, writer=None):
+    """
+     A generator of the timestep elements of a SUMO emission dump, see iter_children.
+    """
+    for element in iter_children(emissions_file, writer):
+        if element.tag == 'timestep':
+            yield element
+
+
+class XmlStreamWriter:
+    """
+     Writer of an XML file whose top-level elements are written one at a time. The root element is taken from the
+     streamed source file (see iter_children): the first one opens the file, and the root is closed in close.
+     :param target_file: The path of the written file.
+     :param head: Elements written right after the opening tag of the root.
+    """
+
+    def __init__(self, target_file, head=()):
+        self.head = head
+        self.root_tag = None
+        self.file = open(target_file, 'w', encoding='utf-8')
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+
+    def begin(self, root, namespaces):
+        """
+         Writes the opening tag of the root element, only the first root of the streamed files is written.
+        """
+        if self.root_tag is None:
+            self.root_tag = root.tag
+            self.file.write(open_tag(root, namespaces) + '\n    ')
+            for element in self.head:
+                self.write(element)
+
+    def write(self, element):
+        self.file.write(ET.tostring(element, encoding='unicode'))
+
+    def close(self):
+        if self.root_tag is not None:
+            self.file.write(f'</{self.root_tag}>\n')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+def open_tag(element, namespaces):
+    """
+     Returns the opening tag of the element with its namespace declarations and attributes, for elements that are
+     written before their content is parsed.
+    """
+    attributes = [f'xmlns:{prefix}={quoteattr(uri)}' if prefix else f'xmlns={quoteattr(uri)}'
+                  for uri, prefix in namespaces.items()]
+    for name, value in element.attrib.items():
+        if name.startswith('{'):
+            uri, local_name = name[1:].split('}')
+            name = f'{namespaces[uri]}:{local_name}' if namespaces.get(uri) else local_name
+        attributes.append(f'{name}={quoteattr(value)}')
+    return '<' + ' '.join([element.tag] + attributes) + '>'